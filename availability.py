@@ -0,0 +1,110 @@
+import bisect
+from datetime import datetime, date
+from typing import NamedTuple
+
+
+class FreeSlot(NamedTuple):
+    id: int
+    start_time: str
+    start_dt: datetime
+    seats_left: int = 1
+    capacity: int = 1
+
+
+def _order(slot: FreeSlot):
+    return slot.start_time, slot.id
+
+
+class AvailabilityIndex:
+    """
+    Индекс свободных слотов в памяти процесса: слоты разложены по дням,
+    внутри дня отсортированы по времени, плюс словарь slot_id -> слот.
+    Время разбирается один раз при добавлении, клавиатуры используют готовый start_dt.
+    Слот лежит в индексе, пока в нем есть свободные места (seats_left > 0).
+    Заполняется один раз при старте и обновляется функциями записи в db.py.
+    Прошедшие слоты отбрасываются лениво при чтении.
+    """
+
+    def __init__(self):
+        self._by_day: dict[date, list[FreeSlot]] = {}
+        self._by_id: dict[int, FreeSlot] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, slot_id: int) -> bool:
+        return slot_id in self._by_id
+
+    def load(self, rows):
+        """Перестраивает индекс по строкам (slot_id, start_time ISO, свободно мест, вместимость)."""
+        self.clear()
+        for slot_id, start_iso, seats_left, capacity in rows:
+            self.set_seats(slot_id, start_iso, seats_left, capacity)
+
+    def clear(self):
+        self._by_day.clear()
+        self._by_id.clear()
+
+    def set_seats(self, slot_id: int, start_iso: str, seats_left: int, capacity: int = 1):
+        """Добавляет слот или обновляет число мест; при seats_left <= 0 убирает его."""
+        if seats_left <= 0:
+            self.remove(slot_id)
+            return
+        current = self._by_id.get(slot_id)
+        if current is None:
+            slot = FreeSlot(slot_id, start_iso, datetime.fromisoformat(start_iso), seats_left, capacity)
+            bisect.insort(self._by_day.setdefault(slot.start_dt.date(), []), slot, key=_order)
+            self._by_id[slot_id] = slot
+            return
+        slot = current._replace(seats_left=seats_left, capacity=capacity)
+        bucket = self._by_day[slot.start_dt.date()]
+        bucket[bisect.bisect_left(bucket, _order(slot), key=_order)] = slot
+        self._by_id[slot_id] = slot
+
+    def remove(self, slot_id: int):
+        slot = self._by_id.pop(slot_id, None)
+        if slot is None:
+            return
+        day = slot.start_dt.date()
+        bucket = self._by_day.get(day)
+        if not bucket:
+            return
+        i = bisect.bisect_left(bucket, _order(slot), key=_order)
+        if i < len(bucket) and bucket[i].id == slot_id:
+            del bucket[i]
+        if not bucket:
+            del self._by_day[day]
+
+    def remove_day(self, day: date):
+        for slot in self._by_day.pop(day, []):
+            self._by_id.pop(slot.id, None)
+
+    def _expire(self, now: datetime):
+        today = now.date()
+        for day in [d for d in self._by_day if d < today]:
+            self.remove_day(day)
+
+        bucket = self._by_day.get(today)
+        if bucket:
+            now_iso = now.isoformat()
+            cut = bisect.bisect_right(bucket, (now_iso, float("inf")), key=_order)
+            for slot in bucket[:cut]:
+                self._by_id.pop(slot.id, None)
+            del bucket[:cut]
+            if not bucket:
+                del self._by_day[today]
+
+    def days(self, now: datetime | None = None) -> list[date]:
+        """Дни, на которые есть хотя бы один свободный будущий слот."""
+        self._expire(now or datetime.now())
+        return sorted(self._by_day)
+
+    def slots_on_day(self, day: date, now: datetime | None = None) -> list[FreeSlot]:
+        """Свободные будущие слоты дня, отсортированные по времени."""
+        self._expire(now or datetime.now())
+        return list(self._by_day.get(day, []))
+
+    def free_slots(self, now: datetime | None = None) -> list[FreeSlot]:
+        """Все свободные будущие слоты, отсортированные по времени."""
+        self._expire(now or datetime.now())
+        return [slot for day in sorted(self._by_day) for slot in self._by_day[day]]
@@ -0,0 +1,364 @@
+"""
+Нагрузочный прогон бота: настоящий Dispatcher с роутерами handlers.user и
+handlers.admin, временная база SQLite и локальная замена Telegram Bot API.
+
+    python -m benchmarks.run --users 500 --window 10 --output bench.json
+
+Результат — JSON с пропускной способностью, p50/p95/p99 задержки обработки,
+долей времени в БД и числом нарушений (двойные записи, превышение лимита)
+по каждому сценарию; два файла разных версий удобно сравнивать diff'ом.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, date
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCH_BOT_TOKEN = "123456:bench-token"
+ADMIN_ID = 1
+USER_ID_BASE = 1_000_000
+
+
+class Recorder:
+    """Задержки обработки обновлений и время, проведенное в БД."""
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.db_time = 0.0
+        self.started = 0.0
+        self.finished = 0.0
+
+    async def feed(self, dp, bot, update):
+        t0 = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            self.errors += 1
+        finally:
+            self.latencies.append(time.perf_counter() - t0)
+
+    def summary(self) -> dict:
+        lat = sorted(self.latencies)
+        duration = self.finished - self.started
+
+        def pct(p: float) -> float:
+            if not lat:
+                return 0.0
+            return round(lat[min(len(lat) - 1, int(p / 100 * len(lat)))] * 1000, 3)
+
+        handler_time = sum(lat)
+        return {
+            "updates": len(lat),
+            "errors": self.errors,
+            "duration_s": round(duration, 3),
+            "throughput_ups": round(len(lat) / duration, 2) if duration else 0.0,
+            "latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99),
+                           "max": round(lat[-1] * 1000, 3) if lat else 0.0},
+            "db_time_share": round(self.db_time / handler_time, 4) if handler_time else 0.0,
+        }
+
+
+def instrument_db(db_module, recorder_ref: list):
+    """Считает время внутри read()/write()/locked() базы (включая ожидание блокировки)."""
+    for name in ("read", "write", "locked"):
+        original = getattr(db_module.Database, name)
+
+        def wrapper(self, _original=original):
+            @contextlib.asynccontextmanager
+            async def timed():
+                t0 = time.perf_counter()
+                try:
+                    async with _original(self) as conn:
+                        yield conn
+                finally:
+                    recorder_ref[0].db_time += time.perf_counter() - t0
+            return timed()
+
+        setattr(db_module.Database, name, wrapper)
+
+
+class UpdateFactory:
+
+    def __init__(self):
+        from aiogram.types import Update, Message, CallbackQuery, Chat, User
+        self.Update, self.Message, self.CallbackQuery = Update, Message, CallbackQuery
+        self.Chat, self.User = Chat, User
+        self._next_id = 0
+
+    def _id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _user(self, user_id: int):
+        return self.User(id=user_id, is_bot=False, first_name=f"u{user_id}", username=f"u{user_id}")
+
+    def message(self, user_id: int, text: str):
+        uid = self._id()
+        return self.Update(update_id=uid, message=self.Message(
+            message_id=uid, date=datetime.now(), text=text,
+            chat=self.Chat(id=user_id, type="private"), from_user=self._user(user_id),
+        ))
+
+    def callback(self, user_id: int, data: str, message_id: int | None = None):
+        uid = self._id()
+        bot_message = self.Message(
+            message_id=message_id or uid, date=datetime.now(), text="…",
+            chat=self.Chat(id=user_id, type="private"),
+            from_user=self.User(id=1, is_bot=True, first_name="bench"),
+        )
+        return self.Update(update_id=uid, callback_query=self.CallbackQuery(
+            id=str(uid), from_user=self._user(user_id), chat_instance="bench",
+            message=bot_message, data=data,
+        ))
+
+
+async def integrity_violations(db_module) -> dict:
+    limit = await db_module.get_max_user_bookings()
+    async with db_module.get_db().read() as conn:
+        cursor = await conn.execute("""
+            SELECT COUNT(*) FROM slots s
+            WHERE (SELECT COUNT(*) FROM bookings b WHERE b.slot_id = s.id) > s.capacity
+        """)
+        overbooked = (await cursor.fetchone())[0]
+        cursor = await conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT s.booked_count, s.is_booked, s.capacity,
+                       (SELECT COUNT(*) FROM bookings b WHERE b.slot_id = s.id) AS actual
+                FROM slots s
+            ) WHERE booked_count != actual OR is_booked != (actual >= capacity)
+        """)
+        counter_mismatch = (await cursor.fetchone())[0]
+        cursor = await conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT b.user_id FROM bookings b JOIN slots s ON s.id = b.slot_id
+                WHERE s.start_time > ? GROUP BY b.user_id HAVING COUNT(*) > ?
+            )""", (datetime.now().isoformat(), limit))
+        over_limit = (await cursor.fetchone())[0]
+        cursor = await conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT day, COUNT(*) AS slots, SUM(booked_count) AS booked FROM slots GROUP BY day
+            ) s LEFT JOIN day_summary d USING (day)
+            WHERE d.slots IS NOT s.slots OR d.booked IS NOT s.booked
+        """)
+        summary_mismatch = (await cursor.fetchone())[0]
+    return {"overbooked": overbooked, "counter_mismatch": counter_mismatch,
+            "over_limit": over_limit, "summary_mismatch": summary_mismatch}
+
+
+async def publish_week(db_module, admin_module, days: int = 7, capacity: int = 1):
+    grid = {datetime.strptime(t, "%H:%M").time() for t in admin_module.ADMIN_GRID}
+    for i in range(1, days + 1):
+        await db_module.set_day_slots(date.today() + timedelta(days=i), grid, capacity=capacity)
+
+
+async def scenario_booking_rush(ctx, users: int, window: float, attempts: int, capacity: int) -> dict:
+    """N пользователей за window секунд: /new → день → слот, до attempts раз каждый."""
+    db, admin, dp, bot, factory = ctx["db"], ctx["admin"], ctx["dp"], ctx["bot"], ctx["factory"]
+    await publish_week(db, admin, capacity=capacity)
+    user_ids = [USER_ID_BASE + i for i in range(users)]
+    for user_id in user_ids:
+        await db.set_user_name(user_id, f"Bench User{user_id}")
+
+    rec = Recorder()
+    ctx["recorder"][0] = rec
+    rng = ctx["rng"]
+
+    async def user_flow(user_id: int):
+        await asyncio.sleep(rng.uniform(0, window))
+        for _ in range(attempts):
+            await rec.feed(dp, bot, factory.message(user_id, "/new"))
+            days = await db.get_free_days()
+            if not days:
+                return
+            day = rng.choice(days)
+            await rec.feed(dp, bot, factory.callback(user_id, f"user_day:{day.isoformat()}"))
+            shown = await db.get_free_slots_on_day(day)
+            if not shown:
+                continue
+            # Пользователь смотрит на клавиатуру, пока другие успевают занять слоты.
+            await asyncio.sleep(rng.uniform(0.05, 0.5))
+            await rec.feed(dp, bot, factory.callback(user_id, f"slot:{rng.choice(shown).id}"))
+
+    rec.started = time.perf_counter()
+    await asyncio.gather(*(user_flow(u) for u in user_ids))
+    rec.finished = time.perf_counter()
+
+    result = rec.summary()
+    result["violations"] = await integrity_violations(db)
+    async with db.get_db().read() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM bookings")
+        result["bookings"] = (await cursor.fetchone())[0]
+    return result
+
+
+async def scenario_admin_bulk_edit(ctx, rounds: int) -> dict:
+    """Админ rounds раз проходит /editslots по 7 дням: переключает половину сетки и подтверждает."""
+    db, admin, dp, bot, factory = ctx["db"], ctx["admin"], ctx["dp"], ctx["bot"], ctx["factory"]
+    await publish_week(db, admin)
+    rec = Recorder()
+    ctx["recorder"][0] = rec
+    rng = ctx["rng"]
+
+    rec.started = time.perf_counter()
+    for _ in range(rounds):
+        for i in range(1, 8):
+            day = date.today() + timedelta(days=i)
+            await rec.feed(dp, bot, factory.message(ADMIN_ID, "/editslots"))
+            # Выбор дня, галочки и подтверждение — нажатия на клавиатуре одного сообщения.
+            picker_id = factory._id()
+            await rec.feed(dp, bot, factory.callback(ADMIN_ID, f"admin_day:{day.isoformat()}", picker_id))
+            for t_str in rng.sample(admin.ADMIN_GRID, len(admin.ADMIN_GRID) // 2):
+                await rec.feed(dp, bot, factory.callback(ADMIN_ID, f"toggle:{t_str}", picker_id))
+            await rec.feed(dp, bot, factory.callback(ADMIN_ID, "confirm_slots", picker_id))
+    rec.finished = time.perf_counter()
+
+    result = rec.summary()
+    result["violations"] = await integrity_violations(db)
+    return result
+
+
+async def scenario_reminder_fanout(ctx, recipients: int) -> dict:
+    """Одновременная рассылка напоминаний recipients пользователям."""
+    db, admin, bot = ctx["db"], ctx["admin"], ctx["bot"]
+    notifications = ctx["notifications"]
+    await publish_week(db, admin, days=max(1, -(-recipients // len(admin.ADMIN_GRID))))
+    slots = await db.get_free_slots()
+    pairs = []
+    for i, slot in enumerate(slots[:recipients]):
+        user_id = USER_ID_BASE + i
+        await db.set_user_name(user_id, f"Bench User{user_id}")
+        if (await db.book_slot_safe(user_id, slot.id)).status == db.BookingStatus.SUCCESS:
+            pairs.append((user_id, slot.start_time))
+
+    rec = Recorder()
+    ctx["recorder"][0] = rec
+    sent_before = ctx["server"].calls["sendmessage"]
+
+    async def remind(user_id: int, start_time: str):
+        t0 = time.perf_counter()
+        try:
+            await notifications.send_reminder(bot, user_id, start_time)
+        except Exception:
+            rec.errors += 1
+        finally:
+            rec.latencies.append(time.perf_counter() - t0)
+
+    rec.started = time.perf_counter()
+    await asyncio.gather(*(remind(u, s) for u, s in pairs))
+    rec.finished = time.perf_counter()
+
+    result = rec.summary()
+    result["delivered"] = ctx["server"].calls["sendmessage"] - sent_before
+    return result
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from fake_telegram import FakeTelegramServer
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import db
+    import notifications
+    from handlers import admin
+    from bot import build_dispatcher
+
+    recorder_ref = [Recorder()]
+    instrument_db(db, recorder_ref)
+
+    server = FakeTelegramServer(latency=args.api_latency)
+    await server.start()
+    await db.init_db()
+    bot = Bot(BENCH_BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(server.base_url)))
+    dp, _ = build_dispatcher()
+
+    ctx = {"db": db, "admin": admin, "notifications": notifications, "dp": dp, "bot": bot,
+           "server": server, "factory": UpdateFactory(), "recorder": recorder_ref,
+           "rng": random.Random(args.seed)}
+
+    scenarios = {
+        "booking_rush": lambda: scenario_booking_rush(ctx, args.users, args.window, args.attempts, args.capacity),
+        "admin_bulk_edit": lambda: scenario_admin_bulk_edit(ctx, args.admin_rounds),
+        "reminder_fanout": lambda: scenario_reminder_fanout(ctx, args.reminders),
+    }
+    results = {}
+    try:
+        for name in args.scenarios.split(","):
+            await db.clear_all_bookings_and_slots()
+            results[name] = await scenarios[name]()
+            results[name]["api_calls"] = dict(server.calls)
+            server.calls.clear()
+    finally:
+        await bot.session.close()
+        await server.stop()
+        await db.close_db()
+
+    return {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "params": vars(args),
+        },
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота с фейковым Telegram API")
+    parser.add_argument("--scenarios", default="booking_rush,admin_bulk_edit,reminder_fanout")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--window", type=float, default=10.0, help="секунды, за которые приходят пользователи")
+    parser.add_argument("--attempts", type=int, default=3, help="попыток записи на пользователя")
+    parser.add_argument("--capacity", type=int, default=1, help="мест в слоте для booking_rush")
+    parser.add_argument("--admin-rounds", type=int, default=3)
+    parser.add_argument("--reminders", type=int, default=500)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка фейкового API, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", choices=("sqlite", "memory"), default="sqlite",
+                        help="движок базы (DB_ENGINE): файл или память процесса")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    # Конфиг бота читается при импорте, поэтому окружение готовим до импорта модулей бота.
+    workdir = tempfile.mkdtemp(prefix="booking_bench_")
+    os.environ.update({
+        "BOT_TOKEN": BENCH_BOT_TOKEN,
+        "DB_NAME": os.path.join(workdir, "bench.sqlite"),
+        "DB_ENGINE": args.engine,
+        "ADMIN_IDS": str(ADMIN_ID),
+    })
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(workdir)
+    sys.path[:0] = [str(REPO_ROOT), str(Path(__file__).resolve().parent)]
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,176 @@
 import asyncio
+import multiprocessing
+import signal
+import sys
+from datetime import date, datetime, time
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from config import BOT_TOKEN
-from db import init_db
+from config import (
+    BOT_TOKEN, DB_ENGINE, FSM_STATE_TTL_HOURS, BOT_MODE, SCHEDULE_WEEKS_AHEAD,
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_DRAIN_SECONDS
+)
+from db import init_db, close_db
+from fsm_storage import SQLiteStorage
 from handlers import user, admin
+from logger_config import logger, use_worker_log_files
+from metrics import setup_metrics, start_metrics_server
 from notifications import (
-    send_daily_report_and_clear, 
-    send_tomorrow_admin_report, 
-    send_2h_reminders
+    send_daily_report_and_clear,
+    send_tomorrow_admin_report,
+    archive_history,
+    publish_schedule
 )
+from reminders import setup_reminders, restore_reminders
+from waitlist import setup_waitlist, restore_holds
 
 
-async def main():
-    await init_db()
+def build_dispatcher() -> tuple[Dispatcher, SQLiteStorage]:
+    storage = SQLiteStorage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(admin.router)
+    dp.include_router(user.router)
+    setup_metrics(dp)
+    return dp, storage
 
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
 
+async def start_scheduler(bot: Bot, storage: SQLiteStorage, resync_reminders: bool) -> AsyncIOScheduler:
     scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
     scheduler.add_job(send_daily_report_and_clear, "cron", hour=23, minute=0, args=[bot])
     scheduler.add_job(send_tomorrow_admin_report, "cron", hour=23, minute=0, args=[bot])
-    scheduler.add_job(send_2h_reminders, "cron", hour='9-23', minute=30, args=[bot])
+    scheduler.add_job(storage.expire, "interval", hours=1, args=[FSM_STATE_TTL_HOURS * 3600])
+    if SCHEDULE_WEEKS_AHEAD > 0:
+        scheduler.add_job(publish_schedule, "cron", hour=0, minute=5, args=[bot])
+    # Догоняем архивацию дней, пропущенных, пока бот был выключен. Сегодняшние
+    # слоты остаются в рабочих таблицах до вечернего отчета, который их и архивирует.
+    await archive_history(datetime.combine(date.today(), time.min))
+    setup_reminders(scheduler, bot)
+    setup_waitlist(scheduler, bot)
+    restored = await restore_reminders()
+    logger.info(f"Восстановлено напоминаний: {restored}")
+    await restore_holds()
+    if resync_reminders:
+        # Записи и места из очереди, выданные в других воркерах, подхватываются отсюда.
+        scheduler.add_job(restore_reminders, "interval", minutes=1)
+        scheduler.add_job(restore_holds, "interval", minutes=1)
     scheduler.start()
+    return scheduler
 
-    dp.include_router(admin.router)
-    dp.include_router(user.router)
 
-    await dp.start_polling(bot)
+async def run_polling():
+    await init_db()
+
+    bot = Bot(token=BOT_TOKEN)
+    dp, storage = build_dispatcher()
+    scheduler = await start_scheduler(bot, storage, resync_reminders=False)
+    metrics_runner = await start_metrics_server()
+
+    try:
+        await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_db()
+
+
+async def run_webhook_worker(worker_index: int, workers: int):
+    """
+    Один процесс-воркер webhook-сервера. Планировщик и setWebhook — только
+    в воркере 0. При остановке сервер перестает принимать соединения и ждет
+    завершения начатых обновлений до WEBHOOK_DRAIN_SECONDS.
+    """
+    await init_db()
+
+    bot = Bot(token=BOT_TOKEN)
+    dp, storage = build_dispatcher()
+
+    scheduler = None
+    if worker_index == 0:
+        scheduler = await start_scheduler(bot, storage, resync_reminders=workers > 1)
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET, handle_in_background=False
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_DRAIN_SECONDS, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=workers > 1)
+    await site.start()
+    metrics_runner = await start_metrics_server(port_offset=worker_index)
+    logger.info(f"Воркер {worker_index}: webhook на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info(f"Воркер {worker_index}: остановка, завершаем начатые обновления")
+        if scheduler is not None:
+            scheduler.shutdown(wait=False)
+        await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_db()
+
+
+def _webhook_worker_entry(worker_index: int, workers: int):
+    if workers > 1:
+        use_worker_log_files(worker_index)
+    try:
+        asyncio.run(run_webhook_worker(worker_index, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_webhook():
+    workers = max(WEBHOOK_WORKERS, 1)
+    if workers > 1 and sys.platform == "win32":
+        logger.warning("Несколько воркеров требуют SO_REUSEPORT, на Windows запускается один")
+        workers = 1
+
+    if workers > 1 and DB_ENGINE == "memory":
+        logger.warning("База в памяти не общая для процессов, запускается один воркер")
+        workers = 1
+
+    if workers == 1:
+        return _webhook_worker_entry(0, 1)
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_webhook_worker_entry, args=(i, workers), name=f"webhook-{i}")
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+
+    def stop_workers(signum, frame):
+        # SIGTERM воркерам: каждый дорабатывает начатые обновления и завершается.
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+    for p in processes:
+        p.join()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(run_polling())
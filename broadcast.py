@@ -0,0 +1,140 @@
+import asyncio
+from typing import Iterable, NamedTuple
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramNetworkError, TelegramServerError, TelegramAPIError
+)
+
+from config import (BROADCAST_WORKERS, BROADCAST_RATE, BROADCAST_CHAT_INTERVAL,
+                    BROADCAST_RETRIES)
+from logger_config import logger
+
+
+class OutgoingMessage(NamedTuple):
+    chat_id: int
+    text: str
+    parse_mode: str | None = "Markdown"
+    reply_markup: InlineKeyboardMarkup | None = None
+
+
+class DeliveryReport(NamedTuple):
+    delivered: int
+    failed: list[int]
+
+
+class RateLimiter:
+    """
+    Token bucket на весь процесс: не больше rate сообщений в секунду,
+    плюс пауза для всех отправителей после RetryAfter от Telegram.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst or max(int(rate), 1)
+        self._tokens = float(self.burst)
+        self._updated = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._updated:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatThrottle:
+    """Минимальный интервал между сообщениями в один и тот же чат."""
+
+    def __init__(self, interval: float, max_entries: int = 10000):
+        self.interval = interval
+        self.max_entries = max_entries
+        self._next_at: dict[int, float] = {}
+
+    def reserve(self, chat_id: int) -> float:
+        """Резервирует ближайшее окно для чата и возвращает, сколько ждать."""
+        now = asyncio.get_running_loop().time()
+        if len(self._next_at) > self.max_entries:
+            self._next_at = {c: t for c, t in self._next_at.items() if t > now}
+        at = max(now, self._next_at.get(chat_id, now))
+        self._next_at[chat_id] = at + self.interval
+        return at - now
+
+
+_global_limiter = RateLimiter(BROADCAST_RATE)
+_chat_throttle = ChatThrottle(BROADCAST_CHAT_INTERVAL)
+
+
+async def _deliver(bot: Bot, message: OutgoingMessage) -> bool:
+    backoff = 1.0
+    for attempt in range(BROADCAST_RETRIES + 1):
+        delay = _chat_throttle.reserve(message.chat_id)
+        if delay:
+            await asyncio.sleep(delay)
+        await _global_limiter.acquire()
+        try:
+            await bot.send_message(message.chat_id, message.text, parse_mode=message.parse_mode,
+                                   reply_markup=message.reply_markup)
+            return True
+        except TelegramRetryAfter as e:
+            logger.warning(f"Лимит Telegram: пауза {e.retry_after} с (чат {message.chat_id})")
+            _global_limiter.pause(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt == BROADCAST_RETRIES:
+                logger.error(f"Не удалось доставить сообщение {message.chat_id}: {e}")
+                return False
+            await asyncio.sleep(backoff)
+            backoff *= 2
+        except TelegramAPIError as e:
+            logger.error(f"Не удалось доставить сообщение {message.chat_id}: {e}")
+            return False
+    logger.error(f"Не удалось доставить сообщение {message.chat_id}: исчерпаны попытки")
+    return False
+
+
+async def broadcast(bot: Bot, messages: Iterable[OutgoingMessage],
+                    workers: int = BROADCAST_WORKERS) -> DeliveryReport:
+    """
+    Рассылает сообщения пулом воркеров с учетом общего лимита и лимита на чат.
+    RetryAfter приостанавливает всю отправку, сетевые ошибки и 5xx повторяются
+    с экспоненциальной задержкой.
+    """
+    queue: asyncio.Queue[OutgoingMessage] = asyncio.Queue()
+    for message in messages:
+        queue.put_nowait(message)
+    if queue.empty():
+        return DeliveryReport(0, [])
+
+    delivered = 0
+    failed: list[int] = []
+
+    async def worker():
+        nonlocal delivered
+        while True:
+            try:
+                message = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if await _deliver(bot, message):
+                delivered += 1
+            else:
+                failed.append(message.chat_id)
+
+    await asyncio.gather(*(worker() for _ in range(min(max(workers, 1), queue.qsize()))))
+    return DeliveryReport(delivered, failed)
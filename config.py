@@ -5,6 +5,80 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_NAME = os.getenv("DB_NAME", "db.sqlite")
+# sqlite — файл DB_NAME; memory — та же схема в памяти процесса (тесты, бенчмарки), данные не сохраняются.
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+# Строк за транзакцию в миграциях больших таблиц (migrations.py).
+DB_MIGRATION_BATCH_SIZE = int(os.getenv("DB_MIGRATION_BATCH_SIZE", "5000"))
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", "1.0"))
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", "3"))
+
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "120"))
+
+FSM_STATE_TTL_HOURS = float(os.getenv("FSM_STATE_TTL_HOURS", "24"))
+
+# 0 — хранить архив бессрочно.
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "730"))
+
+# Мест в новом слоте (/editslots); групповые занятия — больше 1.
+SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", "1"))
+
+# Сколько минут у пользователя из очереди, чтобы подтвердить освободившееся место.
+WAITLIST_CONFIRM_MINUTES = int(os.getenv("WAITLIST_CONFIRM_MINUTES", "15"))
+
+# На сколько недель вперед ежедневно генерировать слоты по шаблону; 0 — только вручную (/publish).
+SCHEDULE_WEEKS_AHEAD = int(os.getenv("SCHEDULE_WEEKS_AHEAD", "4"))
+
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "512"))
+# Окно склейки правок галочек в /editslots, секунды; 0 — править сразу.
+ADMIN_EDIT_DEBOUNCE = float(os.getenv("ADMIN_EDIT_DEBOUNCE", "0.7"))
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+WEBHOOK_DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "30"))
+
+# Антифлуд: токенов в секунду и размер пачки на пользователя и вид события; 0 — выключено.
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+THROTTLE_CACHE_SIZE = int(os.getenv("THROTTLE_CACHE_SIZE", "10000"))
+
+# text — как раньше; json — по строке JSON на запись с полями user_id, slot, action, duration_ms.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Например "midnight": ротация по времени вместо размера.
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+
+# Выгрузка /export держит CSV в памяти до этого размера, дальше — во временном файле.
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", str(1024 * 1024)))
+
+# 0 — эндпоинт /metrics выключен; у webhook-воркера i порт METRICS_PORT + i.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# С несколькими процессами индекс свободных слотов сверяется с базой не чаще раза в N секунд.
+AVAILABILITY_SYNC_SECONDS = float(os.getenv(
+    "AVAILABILITY_SYNC_SECONDS",
+    "1" if BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1 else "0"
+))
+# «Не зарегистрирован» кэшируется на N секунд; с несколькими процессами
+# по умолчанию не кэшируется: /name мог прийти в соседний воркер.
+USER_NEGATIVE_TTL = float(os.getenv(
+    "USER_NEGATIVE_TTL",
+    "0" if BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1 else "30"
+))
 
 ADMIN_IDS = [
     int(i.strip()) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()
@@ -1,183 +1,663 @@
 import aiosqlite
 import asyncio
-from datetime import datetime, timedelta, date
-from config import DB_NAME
+import contextlib
+import time as time_module
+from datetime import datetime, timedelta, date, time
+from enum import Enum
+from typing import NamedTuple
+from config import (DB_NAME, DB_ENGINE, DB_READ_POOL_SIZE, DB_BUSY_TIMEOUT_MS,
+                    DB_STATEMENT_CACHE,
+                    USER_CACHE_SIZE, USER_NEGATIVE_TTL, AVAILABILITY_SYNC_SECONDS, SLOT_CAPACITY,
+                    WAITLIST_CONFIRM_MINUTES)
+from availability import AvailabilityIndex
+from cache import LRUCache
+from metrics import timed_query, observe_lock_wait
+from migrations import SCHEMA_VERSION, migrate, get_version as get_schema_version
 
 _settings_cache: dict[str, int] = {}
 _settings_lock = asyncio.Lock()
 
+# Индекс свободных слотов; меняется только после успешного commit в функциях ниже.
+_availability = AvailabilityIndex()
+_availability_version: int | None = None
+_availability_checked_at = 0.0
+
+# user_id -> full_name; None с коротким TTL означает «не зарегистрирован».
+# Сбрасывается вместе с индексом, когда базу изменил другой процесс.
+_user_names = LRUCache(USER_CACHE_SIZE)
+_NOT_CACHED = object()
+
 DEFAULT_MAX_USER_BOOKINGS = 2
 
 
+class Database:
+    """
+    Долгоживущие соединения с SQLite на весь процесс.
+    Одно соединение-писатель (запись сериализуется блокировкой) и небольшой
+    пул соединений для чтения. Режим WAL позволяет читателям не ждать писателя.
+    Движок memory держит ту же схему в памяти процесса, без диска, на одном
+    соединении: чтения идут через писателя под той же блокировкой и видят
+    только зафиксированные данные.
+    """
+
+    def __init__(self, path: str, read_pool_size: int = DB_READ_POOL_SIZE, engine: str = DB_ENGINE):
+        if engine not in ("sqlite", "memory"):
+            raise ValueError(f"Неизвестный DB_ENGINE: {engine}")
+        self.path = path
+        self.engine = engine
+        self.read_pool_size = max(read_pool_size, 1)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    async def _connect(self) -> aiosqlite.Connection:
+        memory = self.engine == "memory"
+        conn = await aiosqlite.connect(
+            f"file:{self.path}?mode=memory&cache=shared" if memory else self.path,
+            uri=memory,
+            isolation_level=None,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        for pragma in (f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}", "PRAGMA synchronous = NORMAL"):
+            async with conn.execute(pragma):
+                pass
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        if self.engine == "memory":
+            # В общем кэше памяти блокировки потабличные и busy_timeout на них
+            # не действует: отдельный читатель падал бы с «table is locked»
+            # посреди чужой транзакции. Читаем через писателя, см. read().
+            return
+        async with self._writer.execute("PRAGMA journal_mode = WAL"):
+            pass
+        for _ in range(self.read_pool_size):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            self._readers = asyncio.Queue()
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+    @contextlib.asynccontextmanager
+    async def _acquire_writer(self):
+        started = time_module.perf_counter()
+        contended = self._write_lock.locked()
+        async with self._write_lock:
+            observe_lock_wait("write", started, contended)
+            yield
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        """
+        Выдает соединение из пула читателей на время блока. В движке memory
+        это писатель под блокировкой записи, вне транзакции: незафиксированные
+        изменения читателю не видны.
+        """
+        if self.engine == "memory":
+            async with self.locked() as conn:
+                yield conn
+            return
+        started = time_module.perf_counter()
+        contended = self._readers.empty()
+        conn = await self._readers.get()
+        observe_lock_wait("read", started, contended)
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def locked(self):
+        """Выдает соединение-писатель без транзакции, не пуская другие записи процесса."""
+        async with self._acquire_writer():
+            yield self._writer
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        """Выдает соединение-писатель внутри транзакции BEGIN IMMEDIATE."""
+        async with self._acquire_writer():
+            conn = self._writer
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            else:
+                await conn.commit()
+
+
+_db: Database | None = None
+
+
+def get_db() -> Database:
+    if _db is None:
+        raise RuntimeError("База данных не инициализирована, сначала вызовите init_db()")
+    return _db
+
+
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
+
+
 async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
+    """
+    Открывает соединения и доводит схему миграциями (migrations.py).
+    Если PRAGMA user_version уже последняя, DDL не выполняется вовсе.
+    """
+    global _db
+    if _db is None:
+        _db = Database(DB_NAME)
+        await _db.open()
 
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS slots (
-            id INTEGER PRIMARY KEY,
-            start_time TEXT UNIQUE,
-            end_time TEXT,
-            is_booked INTEGER DEFAULT 0
-        )""")
+    async with _db.read() as db:
+        version = await get_schema_version(db)
+    if version < SCHEMA_VERSION:
+        async with _db.locked() as db:
+            await migrate(db)
 
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            user_name TEXT, 
-            slot_id INTEGER UNIQUE
-        )""")
+    await _load_availability()
 
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            full_name TEXT
-        )""")
 
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS settings_limits (
-            key TEXT PRIMARY KEY,
-            value INTEGER NOT NULL CHECK (value >= 1)
+async def _load_availability():
+    """
+    Перечитывает индекс свободных слотов из базы под блокировкой записи процесса
+    и запоминает PRAGMA data_version писателя: она меняется только после
+    коммитов других соединений (например, соседних воркеров).
+    Кэш имен при этом сбрасывается: его тоже могли изменить.
+    """
+    global _availability_version, _availability_checked_at
+    async with get_db().locked() as db:
+        cursor = await db.execute("PRAGMA data_version")
+        version = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT id, start_time, capacity - booked_count, capacity FROM slots "
+            "WHERE is_booked = 0 AND start_time > ?",
+            (datetime.now().isoformat(),)
         )
-        """)
-        await db.commit()
+        _availability.load(await cursor.fetchall())
+    _availability_version = version
+    _user_names.clear()
+    _availability_checked_at = time_module.monotonic()
+
+
+async def _sync_availability():
+    """
+    При нескольких процессах раз в AVAILABILITY_SYNC_SECONDS проверяет,
+    не меняли ли базу другие процессы, и при необходимости перечитывает индекс.
+    """
+    global _availability_checked_at
+    if AVAILABILITY_SYNC_SECONDS <= 0:
+        return
+    if time_module.monotonic() - _availability_checked_at < AVAILABILITY_SYNC_SECONDS:
+        return
+    _availability_checked_at = time_module.monotonic()
+    async with get_db().locked() as db:
+        cursor = await db.execute("PRAGMA data_version")
+        version = (await cursor.fetchone())[0]
+    if version != _availability_version:
+        await _load_availability()
 
 
+@timed_query
 async def set_user_name(user_id: int, full_name: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().write() as db:
         await db.execute(
             "INSERT OR REPLACE INTO users (user_id, full_name) VALUES (?, ?)",
             (user_id, full_name)
         )
-        await db.commit()
 
+    _user_names.set(user_id, full_name)
 
+
+@timed_query
 async def get_user_name(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    await _sync_availability()
+    name = _user_names.get(user_id, _NOT_CACHED)
+    if name is not _NOT_CACHED:
+        return name
+
+    async with get_db().read() as db:
         cursor = await db.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
-        return row[0] if row else None
+
+    if row:
+        _user_names.set(user_id, row[0])
+        return row[0]
+    if USER_NEGATIVE_TTL > 0:
+        _user_names.set(user_id, None, ttl=USER_NEGATIVE_TTL)
+    return None
+
+
+def get_user_cache_stats() -> dict[str, int]:
+    """Счетчики попаданий/промахов кэша имен пользователей."""
+    return _user_names.stats()
 
 
+@timed_query
 async def get_slots_on_day(day: date):
     """Возвращает список start_time (ISO string) для конкретного дня."""
     day_str = day.isoformat()
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().read() as db:
         cursor = await db.execute(
-            "SELECT start_time FROM slots WHERE start_time LIKE ?", 
-            (f"{day_str}%",)
+            "SELECT start_time FROM slots WHERE day = ? ORDER BY start_time",
+            (day_str,)
         )
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
 
 
-async def add_slots_for_day(start: datetime, end: datetime):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO slots (start_time, end_time) VALUES (?, ?)",
-            (start.isoformat(), end.isoformat())
+class Promotion(NamedTuple):
+    booking_id: int
+    user_id: int
+    start_time: str
+    confirm_by: str
+
+
+class SlotDiff(NamedTuple):
+    added: list[str]
+    deleted: list[str]
+    displaced: list[tuple[int, str]]
+
+
+@timed_query
+async def set_day_slots(day: date, times: set[time],
+                        duration: timedelta = timedelta(hours=1),
+                        capacity: int = SLOT_CAPACITY) -> SlotDiff:
+    """
+    Приводит слоты дня к заданному набору времен одной транзакцией.
+    Новые слоты создаются на capacity мест, у оставшихся вместимость не меняется.
+    Возвращает добавленные и удаленные start_time и список (user_id, start_time)
+    всех записей, снятых вместе с удаленными слотами.
+    """
+    day_str = day.isoformat()
+    wanted = {datetime.combine(day, t).isoformat(): datetime.combine(day, t) for t in times}
+
+    async with get_db().write() as db:
+        cursor = await db.execute(
+            "SELECT id, start_time FROM slots WHERE day = ?", (day_str,)
         )
-        await db.commit()
+        existing = {start_time: slot_id for slot_id, start_time in await cursor.fetchall()}
+
+        to_add = sorted(set(wanted) - set(existing))
+        to_delete = sorted(set(existing) - set(wanted))
+        delete_ids = [(existing[start_time],) for start_time in to_delete]
+
+        displaced = []
+        if delete_ids:
+            cursor = await db.execute(f"""
+                SELECT b.user_id, s.start_time FROM bookings b
+                JOIN slots s ON s.id = b.slot_id
+                WHERE s.id IN ({",".join("?" * len(delete_ids))})
+                ORDER BY s.start_time
+            """, [slot_id for slot_id, in delete_ids])
+            displaced = await cursor.fetchall()
+            await db.executemany("DELETE FROM bookings WHERE slot_id = ?", delete_ids)
+            await db.executemany("DELETE FROM waitlist WHERE slot_id = ?", delete_ids)
+            await db.executemany("DELETE FROM slots WHERE id = ?", delete_ids)
+
+        added_ids = []
+        if to_add:
+            await db.executemany(
+                "INSERT OR IGNORE INTO slots (start_time, end_time, day, capacity) VALUES (?, ?, ?, ?)",
+                [(start_time, (wanted[start_time] + duration).isoformat(), day_str, capacity)
+                 for start_time in to_add]
+            )
+            cursor = await db.execute(
+                "SELECT id, start_time FROM slots WHERE day = ? AND is_booked = 0", (day_str,)
+            )
+            added_ids = [row for row in await cursor.fetchall() if row[1] in to_add]
+
+    for slot_id, in delete_ids:
+        _availability.remove(slot_id)
+    now_iso = datetime.now().isoformat()
+    for slot_id, start_time in added_ids:
+        if start_time > now_iso:
+            _availability.set_seats(slot_id, start_time, capacity, capacity)
+
+    return SlotDiff(to_add, to_delete, [tuple(row) for row in displaced])
+
+
+class TemplateEntry(NamedTuple):
+    start: time
+    duration: timedelta
+    capacity: int = 1
 
 
-async def delete_slot_by_time(start_time: str):
-    """Удаляет слот и возвращает user_id, если на слот была запись."""
-    async with aiosqlite.connect(DB_NAME) as db:
+class ScheduleDiff(NamedTuple):
+    added: dict[date, list[str]]
+    skipped: list[date]
 
+
+@timed_query
+async def get_schedule_template() -> dict[int, list[TemplateEntry]]:
+    """Недельный шаблон: weekday (0 — понедельник) -> времена по возрастанию."""
+    async with get_db().read() as db:
         cursor = await db.execute(
-            "SELECT s.id, b.user_id FROM slots s LEFT JOIN bookings b ON s.id = b.slot_id WHERE s.start_time = ?", 
-            (start_time,)
+            "SELECT weekday, start, duration_minutes, capacity FROM schedule_template ORDER BY weekday, start"
         )
-        row = await cursor.fetchone()
-        
-        user_id_to_notify = None
-        if row:
-            slot_id, user_id = row
-            user_id_to_notify = user_id
-            
-            await db.execute("DELETE FROM bookings WHERE slot_id = ?", (slot_id,))
-            await db.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
-            await db.commit()
-            
-        return user_id_to_notify
-
-
-async def get_slot_time_str(slot_id: int) -> str:
-    """Получает строку времени для конкретного слота по его ID."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT start_time FROM slots WHERE id = ?", (slot_id,))
-        row = await cursor.fetchone()
-        if row:
-            dt = datetime.fromisoformat(row[0])
-            return dt.strftime("%d.%m в %H:%M")
-        return "неизвестное время"
+        rows = await cursor.fetchall()
+    template: dict[int, list[TemplateEntry]] = {}
+    for weekday, start, minutes, capacity in rows:
+        template.setdefault(weekday, []).append(
+            TemplateEntry(time.fromisoformat(start), timedelta(minutes=minutes), capacity)
+        )
+    return template
 
 
-async def get_slot_time_by_booking(booking_id: int) -> str:
-    """Получает строку времени для слота, привязанного к записи."""
-    async with aiosqlite.connect(DB_NAME) as db:
+@timed_query
+async def set_template_weekday(weekday: int, entries: list[TemplateEntry]) -> ScheduleDiff:
+    """
+    Заменяет шаблон дня недели. В уже опубликованные дни этого дня недели
+    добавляются только времена, которых не было в старом шаблоне: слоты,
+    удаленные вручную через /editslots, не возвращаются. Убранные из шаблона
+    времена остаются в опубликованных днях.
+    """
+    today = date.today()
+    now = datetime.now()
+    async with get_db().write() as db:
+        cursor = await db.execute("SELECT start FROM schedule_template WHERE weekday = ?", (weekday,))
+        old_starts = {row[0] for row in await cursor.fetchall()}
+        await db.execute("DELETE FROM schedule_template WHERE weekday = ?", (weekday,))
+        await db.executemany(
+            "INSERT INTO schedule_template (weekday, start, duration_minutes, capacity) VALUES (?, ?, ?, ?)",
+            [(weekday, e.start.strftime("%H:%M"), int(e.duration.total_seconds() // 60), e.capacity)
+             for e in entries]
+        )
+
+        new_entries = [e for e in entries if e.start.strftime("%H:%M") not in old_starts]
+        if not new_entries:
+            return ScheduleDiff({}, [])
+        # strftime('%w'): 0 — воскресенье, а у date.weekday() 0 — понедельник.
         cursor = await db.execute("""
-            SELECT s.start_time FROM slots s 
-            JOIN bookings b ON s.id = b.slot_id 
-            WHERE b.id = ?
-        """, (booking_id,))
+            SELECT day FROM schedule_materialized
+            WHERE day >= ? AND CAST(strftime('%w', day) AS INTEGER) = ?
+              AND day NOT IN (SELECT day FROM schedule_exceptions)
+            ORDER BY day
+        """, (today.isoformat(), (weekday + 1) % 7))
+        days = [date.fromisoformat(row[0]) for row in await cursor.fetchall()]
+        if not days:
+            return ScheduleDiff({}, [])
+        cursor = await db.execute(
+            "SELECT start_time FROM slots WHERE day BETWEEN ? AND ?",
+            (days[0].isoformat(), days[-1].isoformat())
+        )
+        existing = {row[0] for row in await cursor.fetchall()}
+
+        added: dict[date, list[str]] = {}
+        rows = []
+        for day in days:
+            for entry in new_entries:
+                start = datetime.combine(day, entry.start)
+                if start > now and start.isoformat() not in existing:
+                    rows.append((start.isoformat(), (start + entry.duration).isoformat(),
+                                 day.isoformat(), entry.capacity))
+                    added.setdefault(day, []).append(start.isoformat())
+        if not rows:
+            return ScheduleDiff({}, [])
+        await db.executemany(
+            "INSERT OR IGNORE INTO slots (start_time, end_time, day, capacity) VALUES (?, ?, ?, ?)", rows
+        )
+        cursor = await db.execute(
+            "SELECT id, start_time, capacity - booked_count, capacity FROM slots "
+            "WHERE day BETWEEN ? AND ? AND is_booked = 0",
+            (days[0].isoformat(), days[-1].isoformat())
+        )
+        inserted = {row[0] for row in rows}
+        new_slots = [row for row in await cursor.fetchall() if row[1] in inserted]
+
+    for slot_id, start_time, seats_left, capacity in new_slots:
+        _availability.set_seats(slot_id, start_time, seats_left, capacity)
+
+    return ScheduleDiff(added, [])
+
+
+@timed_query
+async def get_schedule_exceptions(from_day: date) -> list[date]:
+    async with get_db().read() as db:
+        cursor = await db.execute(
+            "SELECT day FROM schedule_exceptions WHERE day >= ? ORDER BY day", (from_day.isoformat(),)
+        )
+        return [date.fromisoformat(row[0]) for row in await cursor.fetchall()]
+
+
+@timed_query
+async def set_schedule_exception(day: date, skip: bool):
+    """Исключает день из генерации шаблона (skip=True) или возвращает его."""
+    async with get_db().write() as db:
+        if skip:
+            await db.execute("INSERT OR IGNORE INTO schedule_exceptions (day) VALUES (?)", (day.isoformat(),))
+        else:
+            await db.execute("DELETE FROM schedule_exceptions WHERE day = ?", (day.isoformat(),))
+
+
+@timed_query
+async def materialize_schedule(weeks: int, today: date | None = None) -> ScheduleDiff:
+    """
+    Создает слоты по недельному шаблону на weeks недель вперед одной транзакцией.
+    Дни, уже сгенерированные раньше, не трогаются, поэтому ручные правки
+    через /editslots сохраняются и повторный запуск ничего не меняет.
+    Исключенные дни пропускаются и не помечаются: снятие исключения вернет их.
+    """
+    today = today or date.today()
+    last_day = today + timedelta(weeks=weeks)
+    now = datetime.now()
+    template = await get_schedule_template()
+
+    async with get_db().write() as db:
+        cursor = await db.execute(
+            "SELECT day FROM schedule_materialized WHERE day BETWEEN ? AND ?",
+            (today.isoformat(), last_day.isoformat())
+        )
+        done = {row[0] for row in await cursor.fetchall()}
+        cursor = await db.execute(
+            "SELECT day FROM schedule_exceptions WHERE day BETWEEN ? AND ?",
+            (today.isoformat(), last_day.isoformat())
+        )
+        exceptions = {row[0] for row in await cursor.fetchall()}
+        cursor = await db.execute(
+            "SELECT start_time FROM slots WHERE day BETWEEN ? AND ?",
+            (today.isoformat(), last_day.isoformat())
+        )
+        existing = {row[0] for row in await cursor.fetchall()}
+
+        added: dict[date, list[str]] = {}
+        skipped, materialized, rows = [], [], []
+        day = today
+        while day <= last_day:
+            day_str = day.isoformat()
+            if day_str in exceptions:
+                skipped.append(day)
+            elif day_str not in done and day.weekday() in template:
+                materialized.append((day_str,))
+                for entry in template[day.weekday()]:
+                    start = datetime.combine(day, entry.start)
+                    start_iso = start.isoformat()
+                    if start > now and start_iso not in existing:
+                        rows.append((start_iso, (start + entry.duration).isoformat(), day_str, entry.capacity))
+                        added.setdefault(day, []).append(start_iso)
+            day += timedelta(days=1)
+
+        await db.executemany(
+            "INSERT OR IGNORE INTO slots (start_time, end_time, day, capacity) VALUES (?, ?, ?, ?)", rows
+        )
+        await db.executemany("INSERT OR IGNORE INTO schedule_materialized (day) VALUES (?)", materialized)
+
+        new_slots = []
+        if rows:
+            cursor = await db.execute(
+                "SELECT id, start_time, capacity - booked_count, capacity FROM slots "
+                "WHERE day BETWEEN ? AND ? AND is_booked = 0",
+                (today.isoformat(), last_day.isoformat())
+            )
+            inserted = {row[0] for row in rows}
+            new_slots = [row for row in await cursor.fetchall() if row[1] in inserted]
+
+    for slot_id, start_time, seats_left, capacity in new_slots:
+        _availability.set_seats(slot_id, start_time, seats_left, capacity)
+
+    return ScheduleDiff(added, skipped)
+
+
+@timed_query
+async def set_slot_capacity(start_time: str, capacity: int) -> tuple[int, list[Promotion]] | None:
+    """
+    Меняет число мест в слоте, если записей не больше нового значения;
+    добавленные места сразу отдаются очереди. Возвращает число записей
+    на слот до изменения и повышения из очереди или None, если слота нет.
+    """
+    promotions = []
+    async with get_db().write() as db:
+        cursor = await db.execute(
+            "SELECT id, booked_count FROM slots WHERE start_time = ?", (start_time,)
+        )
         row = await cursor.fetchone()
-        if row:
-            dt = datetime.fromisoformat(row[0])
-            return dt.strftime("%d.%m в %H:%M")
-        return "неизвестное время"
+        if row is None:
+            return None
+        slot_id, booked_count = row
+        if booked_count > capacity:
+            return booked_count, []
+        await db.execute(
+            "UPDATE slots SET capacity = ?, is_booked = booked_count >= ? WHERE id = ?",
+            (capacity, capacity, slot_id)
+        )
+        promotions = await _promote_waiters(db, slot_id)
+        slot_row = await _refresh_slot(db, slot_id)
+
+    _apply_slot(slot_row)
+    return booked_count, promotions
 
 
+@timed_query
 async def get_free_slots():
     """Возвращает только те свободные слоты, время начала которых еще не наступило."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    await _sync_availability()
+    return _availability.free_slots()
 
-        now_iso = datetime.now().isoformat()
-        
-        query = """
-            SELECT id, start_time FROM slots 
-            WHERE is_booked = 0 AND start_time > ? 
-            ORDER BY start_time ASC
-        """
-        cursor = await db.execute(query, (now_iso,))
-        return await cursor.fetchall()
 
+@timed_query
+async def get_free_days() -> list[date]:
+    """Дни, на которые есть свободные будущие слоты (из индекса в памяти)."""
+    await _sync_availability()
+    return _availability.days()
 
-async def book_slot_safe(user_id: int, slot_id: int, user_name: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id FROM bookings WHERE slot_id = ?", (slot_id,))
-        row = await cursor.fetchone()
-        
-        if row:
-            if row[0] == user_id:
-                return "already_yours"
-            return "taken_by_other"
-            
-        try:
-            await db.execute(
-                "INSERT INTO bookings (user_id, slot_id, user_name) VALUES (?, ?, ?)",
-                (user_id, slot_id, user_name)
-            )
-            await db.execute("UPDATE slots SET is_booked = 1 WHERE id = ?", (slot_id,))
-            await db.commit()
-            return "success"
-        except Exception:
-            return "error"
 
+@timed_query
+async def get_free_slots_on_day(day: date):
+    """Свободные будущие слоты дня (FreeSlot), из индекса в памяти."""
+    await _sync_availability()
+    return _availability.slots_on_day(day)
 
-async def count_user_bookings(user_id: int) -> int:
-    """Возвращает количество будущих записей пользователя."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        now = datetime.now().isoformat()
-        query = "SELECT COUNT(*) FROM bookings b JOIN slots s ON b.slot_id = s.id WHERE b.user_id = ? AND s.start_time > ?"
-        cursor = await db.execute(query, (user_id, now))
-        row = await cursor.fetchone()
-        return row[0] if row else 0
+
+class BookingStatus(str, Enum):
+    SUCCESS = "success"
+    ALREADY_YOURS = "already_yours"
+    TAKEN_BY_OTHER = "taken_by_other"
+    LIMIT_REACHED = "limit_reached"
+    EXPIRED = "expired"
+    NOT_FOUND = "not_found"
+    ERROR = "error"
+
+
+class BookingResult(NamedTuple):
+    status: BookingStatus
+    start_time: str | None = None
+    limit: int | None = None
+
+
+@timed_query
+async def book_slot_safe(user_id: int, slot_id: int) -> BookingResult:
+    """
+    Бронирует место в слоте одной транзакцией BEGIN IMMEDIATE: проверяет, что
+    слот существует, еще не начался, пользователь на него не записан и лимит
+    его записей не исчерпан. Место занимается условным
+    UPDATE ... WHERE booked_count < capacity, так что переполнить слот нельзя.
+    """
+    now = datetime.now().isoformat()
+    seats_left = capacity = 0
+    try:
+        async with get_db().write() as db:
+            cursor = await db.execute("""
+                SELECT s.start_time, s.capacity, s.booked_count,
+                    EXISTS (SELECT 1 FROM bookings WHERE slot_id = s.id AND user_id = :user_id),
+                    (SELECT COUNT(*) FROM bookings ub
+                     JOIN slots us ON ub.slot_id = us.id
+                     WHERE ub.user_id = :user_id AND us.start_time > :now),
+                    COALESCE(
+                        (SELECT value FROM settings_limits WHERE key = 'max_user_bookings'),
+                        :default_limit
+                    ),
+                    (SELECT full_name FROM users WHERE user_id = :user_id)
+                FROM slots s
+                WHERE s.id = :slot_id
+            """, {"user_id": user_id, "slot_id": slot_id, "now": now,
+                  "default_limit": DEFAULT_MAX_USER_BOOKINGS})
+            row = await cursor.fetchone()
+
+            if row is None:
+                result = BookingResult(BookingStatus.NOT_FOUND)
+            else:
+                start_time, capacity, booked_count, is_mine, active_count, limit, user_name = row
+                if is_mine:
+                    result = BookingResult(BookingStatus.ALREADY_YOURS, start_time)
+                elif booked_count >= capacity:
+                    result = BookingResult(BookingStatus.TAKEN_BY_OTHER, start_time)
+                elif start_time <= now:
+                    result = BookingResult(BookingStatus.EXPIRED, start_time)
+                elif active_count >= limit:
+                    result = BookingResult(BookingStatus.LIMIT_REACHED, start_time, limit)
+                else:
+                    cursor = await db.execute("""
+                        UPDATE slots SET booked_count = booked_count + 1,
+                                         is_booked = booked_count + 1 >= capacity
+                        WHERE id = ? AND booked_count < capacity
+                    """, (slot_id,))
+                    if cursor.rowcount == 1:
+                        await db.execute(
+                            "INSERT INTO bookings (user_id, slot_id, user_name) VALUES (?, ?, ?)",
+                            (user_id, slot_id, user_name)
+                        )
+                        await db.execute(
+                            "DELETE FROM waitlist WHERE slot_id = ? AND user_id = ?", (slot_id, user_id)
+                        )
+                        seats_left = capacity - booked_count - 1
+                        result = BookingResult(BookingStatus.SUCCESS, start_time)
+                    else:
+                        result = BookingResult(BookingStatus.TAKEN_BY_OTHER, start_time)
+    except aiosqlite.Error:
+        return BookingResult(BookingStatus.ERROR)
+
+    if result.status == BookingStatus.SUCCESS:
+        _availability.set_seats(slot_id, result.start_time, seats_left, capacity)
+    elif result.status in (BookingStatus.TAKEN_BY_OTHER, BookingStatus.EXPIRED, BookingStatus.NOT_FOUND):
+        # Мест нет (или индекс устарел) — убираем слот из индекса.
+        _availability.remove(slot_id)
+    return result
 
 
-async def get_user_bookings(user_id: int):
+class UserBooking(NamedTuple):
+    id: int
+    start_time: str
+    start_dt: datetime
+
+
+@timed_query
+async def get_user_bookings(user_id: int) -> list[UserBooking]:
     """Возвращает список будущих бронирований пользователя."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().read() as db:
         now = datetime.now().isoformat()
         query = """
             SELECT b.id, s.start_time 
@@ -187,119 +667,474 @@ async def get_user_bookings(user_id: int):
             ORDER BY s.start_time ASC
         """
         cursor = await db.execute(query, (user_id, now))
-        return await cursor.fetchall()
+        rows = await cursor.fetchall()
+    return [UserBooking(b_id, start_time, datetime.fromisoformat(start_time)) for b_id, start_time in rows]
 
 
-async def get_booking_start_time(booking_id: int):
-    """Возвращает start_time (ISO строку) для конкретной записи."""
-    async with aiosqlite.connect(DB_NAME) as db:
+@timed_query
+async def get_booking_start_time(booking_id: int, user_id: int):
+    """Возвращает start_time (ISO строку) записи booking_id, если она принадлежит user_id."""
+    async with get_db().read() as db:
         query = """
             SELECT s.start_time 
             FROM bookings b
             JOIN slots s ON b.slot_id = s.id
-            WHERE b.id = ?
+            WHERE b.id = ? AND b.user_id = ?
         """
-        cursor = await db.execute(query, (booking_id,))
+        cursor = await db.execute(query, (booking_id, user_id))
         row = await cursor.fetchone()
         return row[0] if row else None
 
 
-async def cancel_booking(booking_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT slot_id FROM bookings WHERE id = ?", (booking_id,))
+async def _promote_waiters(db: aiosqlite.Connection, slot_id: int) -> list[Promotion]:
+    """
+    Внутри транзакции записи отдает свободные места слота первым в очереди,
+    у кого не исчерпан лимит записей. Запись создается сразу, но ждет
+    подтверждения до confirm_by; очередник с исчерпанным лимитом остается в очереди.
+    """
+    now = datetime.now()
+    cursor = await db.execute(
+        "SELECT start_time, capacity - booked_count FROM slots WHERE id = ?", (slot_id,)
+    )
+    row = await cursor.fetchone()
+    if row is None or row[0] <= now.isoformat() or row[1] <= 0:
+        return []
+    start_time, free = row
+
+    cursor = await db.execute("""
+        SELECT w.id, w.user_id, u.full_name,
+            (SELECT COUNT(*) FROM bookings ub
+             JOIN slots us ON ub.slot_id = us.id
+             WHERE ub.user_id = w.user_id AND us.start_time > :now),
+            COALESCE(
+                (SELECT value FROM settings_limits WHERE key = 'max_user_bookings'),
+                :default_limit
+            )
+        FROM waitlist w
+        LEFT JOIN users u ON u.user_id = w.user_id
+        WHERE w.slot_id = :slot_id
+        ORDER BY w.id
+    """, {"slot_id": slot_id, "now": now.isoformat(), "default_limit": DEFAULT_MAX_USER_BOOKINGS})
+    waiters = await cursor.fetchall()
+
+    confirm_by = (now + timedelta(minutes=WAITLIST_CONFIRM_MINUTES)).isoformat()
+    promotions = []
+    for waiter_id, user_id, user_name, active_count, limit in waiters:
+        if free <= 0:
+            break
+        if active_count >= limit:
+            continue
+        cursor = await db.execute(
+            "INSERT INTO bookings (user_id, slot_id, user_name, confirm_by) VALUES (?, ?, ?, ?)",
+            (user_id, slot_id, user_name, confirm_by)
+        )
+        promotions.append(Promotion(cursor.lastrowid, user_id, start_time, confirm_by))
+        await db.execute("DELETE FROM waitlist WHERE id = ?", (waiter_id,))
+        free -= 1
+    if promotions:
+        await db.execute("""
+            UPDATE slots SET booked_count = booked_count + ?,
+                             is_booked = booked_count + ? >= capacity
+            WHERE id = ?
+        """, (len(promotions), len(promotions), slot_id))
+    return promotions
+
+
+async def _refresh_slot(db: aiosqlite.Connection, slot_id: int):
+    """Читает свободные места слота для индекса (после commit вызывать _apply_slot)."""
+    cursor = await db.execute(
+        "SELECT id, start_time, capacity - booked_count, capacity FROM slots WHERE id = ?", (slot_id,)
+    )
+    return await cursor.fetchone()
+
+
+def _apply_slot(row):
+    if row is None:
+        return
+    slot_id, start_time, seats_left, capacity = row
+    if start_time > datetime.now().isoformat():
+        _availability.set_seats(slot_id, start_time, seats_left, capacity)
+    else:
+        _availability.remove(slot_id)
+
+
+@timed_query
+async def cancel_booking(booking_id: int, user_id: int) -> list[Promotion]:
+    """
+    Удаляет запись пользователя user_id и возвращает место в слот; освободившееся
+    место в той же транзакции уходит первому из очереди. Возвращает такие повышения.
+    Чужую запись (в том числе по устаревшей кнопке) не трогает.
+    """
+    promotions, slot_row = [], None
+    async with get_db().write() as db:
+        cursor = await db.execute(
+            "SELECT slot_id FROM bookings WHERE id = ? AND user_id = ?", (booking_id, user_id)
+        )
         res = await cursor.fetchone()
         if res:
             slot_id = res[0]
             await db.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-            await db.execute("UPDATE slots SET is_booked = 0 WHERE id = ?", (slot_id,))
-            await db.commit()
+            await db.execute(
+                "UPDATE slots SET booked_count = booked_count - 1, is_booked = 0 WHERE id = ?", (slot_id,)
+            )
+            promotions = await _promote_waiters(db, slot_id)
+            slot_row = await _refresh_slot(db, slot_id)
 
+    _apply_slot(slot_row)
+    return promotions
 
-async def get_all_bookings_report():
-    async with aiosqlite.connect(DB_NAME) as db:
-        query = """
-            SELECT s.start_time, b.user_name 
+
+class WaitlistStatus(str, Enum):
+    JOINED = "joined"
+    ALREADY_WAITING = "already_waiting"
+    ALREADY_BOOKED = "already_booked"
+    SEAT_AVAILABLE = "seat_available"
+    EXPIRED = "expired"
+    NOT_FOUND = "not_found"
+
+
+class WaitlistResult(NamedTuple):
+    status: WaitlistStatus
+    start_time: str | None = None
+    position: int | None = None
+
+
+@timed_query
+async def join_waitlist(user_id: int, slot_id: int) -> WaitlistResult:
+    """Ставит пользователя в очередь на заполненный слот."""
+    now = datetime.now().isoformat()
+    async with get_db().write() as db:
+        cursor = await db.execute("""
+            SELECT s.start_time, s.booked_count >= s.capacity,
+                EXISTS (SELECT 1 FROM bookings WHERE slot_id = s.id AND user_id = :user_id)
+            FROM slots s WHERE s.id = :slot_id
+        """, {"slot_id": slot_id, "user_id": user_id})
+        row = await cursor.fetchone()
+        if row is None:
+            return WaitlistResult(WaitlistStatus.NOT_FOUND)
+        start_time, is_full, is_mine = row
+        if is_mine:
+            return WaitlistResult(WaitlistStatus.ALREADY_BOOKED, start_time)
+        if start_time <= now:
+            return WaitlistResult(WaitlistStatus.EXPIRED, start_time)
+        if not is_full:
+            return WaitlistResult(WaitlistStatus.SEAT_AVAILABLE, start_time)
+
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO waitlist (slot_id, user_id) VALUES (?, ?)", (slot_id, user_id)
+        )
+        status = WaitlistStatus.JOINED if cursor.rowcount == 1 else WaitlistStatus.ALREADY_WAITING
+        cursor = await db.execute("""
+            SELECT COUNT(*) FROM waitlist
+            WHERE slot_id = ? AND id <= (SELECT id FROM waitlist WHERE slot_id = ? AND user_id = ?)
+        """, (slot_id, slot_id, user_id))
+        position = (await cursor.fetchone())[0]
+    return WaitlistResult(status, start_time, position)
+
+
+@timed_query
+async def leave_waitlist(user_id: int, slot_id: int) -> bool:
+    async with get_db().write() as db:
+        cursor = await db.execute(
+            "DELETE FROM waitlist WHERE slot_id = ? AND user_id = ?", (slot_id, user_id)
+        )
+        return cursor.rowcount > 0
+
+
+@timed_query
+async def confirm_hold(booking_id: int, user_id: int) -> str | None:
+    """Подтверждает место из очереди. Возвращает start_time или None, если держать уже нечего."""
+    async with get_db().write() as db:
+        cursor = await db.execute("""
+            UPDATE bookings SET confirm_by = NULL
+            WHERE id = ? AND user_id = ? AND confirm_by IS NOT NULL
+        """, (booking_id, user_id))
+        if cursor.rowcount != 1:
+            return None
+        cursor = await db.execute("""
+            SELECT s.start_time FROM bookings b JOIN slots s ON s.id = b.slot_id WHERE b.id = ?
+        """, (booking_id,))
+        return (await cursor.fetchone())[0]
+
+
+@timed_query
+async def expire_hold(booking_id: int, user_id: int | None = None) -> tuple[int | None, list[Promotion]]:
+    """
+    Снимает неподтвержденную запись из очереди (по таймеру или по отказу
+    пользователя user_id) и передает место дальше. Возвращает user_id владельца
+    (None, если запись уже подтверждена или удалена) и новые повышения.
+    """
+    promotions, slot_row = [], None
+    async with get_db().write() as db:
+        cursor = await db.execute(
+            "SELECT slot_id, user_id, confirm_by FROM bookings WHERE id = ? AND confirm_by IS NOT NULL",
+            (booking_id,)
+        )
+        res = await cursor.fetchone()
+        if res is None or (user_id is not None and res[1] != user_id):
+            return None, []
+        # Срок хранится в базе, а таймер лишь будит: его мог поставить другой
+        # воркер (restore_holds) или он сработал раньше после перевода часов.
+        if user_id is None and res[2] > datetime.now().isoformat():
+            return None, []
+        slot_id, user_id = res[0], res[1]
+        await db.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+        await db.execute(
+            "UPDATE slots SET booked_count = booked_count - 1, is_booked = 0 WHERE id = ?", (slot_id,)
+        )
+        promotions = await _promote_waiters(db, slot_id)
+        slot_row = await _refresh_slot(db, slot_id)
+
+    _apply_slot(slot_row)
+    return user_id, promotions
+
+
+@timed_query
+async def get_pending_holds() -> list[tuple[int, str]]:
+    """(booking_id, confirm_by) всех мест из очереди, ждущих подтверждения."""
+    async with get_db().read() as db:
+        cursor = await db.execute(
+            "SELECT id, confirm_by FROM bookings WHERE confirm_by IS NOT NULL ORDER BY confirm_by"
+        )
+        return await cursor.fetchall()
+
+
+@timed_query
+async def get_bookings_page(limit: int, after: tuple[str, int] | None = None,
+                            before: tuple[str, int] | None = None,
+                            day: date | None = None, user_id: int | None = None):
+    """
+    Страница записей (start_time, user_name, booking_id) в порядке (start_time, id).
+    after/before — ключ (start_time, booking_id), от которого продолжать вперед/назад.
+    Фильтры по дню и пользователю выполняются в SQL по индексам.
+    """
+    conditions, params = [], []
+    if day is not None:
+        conditions.append("s.day = ?")
+        params.append(day.isoformat())
+    if user_id is not None:
+        conditions.append("b.user_id = ?")
+        params.append(user_id)
+    if after is not None:
+        conditions.append("s.start_time >= ? AND (s.start_time > ? OR b.id > ?)")
+        params += [after[0], after[0], after[1]]
+    if before is not None:
+        conditions.append("s.start_time <= ? AND (s.start_time < ? OR b.id < ?)")
+        params += [before[0], before[0], before[1]]
+
+    order = "DESC" if before is not None else "ASC"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    async with get_db().read() as db:
+        cursor = await db.execute(f"""
+            SELECT s.start_time, b.user_name, b.id
             FROM bookings b
             JOIN slots s ON b.slot_id = s.id
-            ORDER BY s.start_time ASC
-        """
-        cursor = await db.execute(query)
-        return await cursor.fetchall()
-    
+            {where}
+            ORDER BY s.start_time {order}, b.id {order}
+            LIMIT ?
+        """, (*params, limit))
+        rows = await cursor.fetchall()
 
+    if before is not None:
+        rows.reverse()
+    return rows
+
+
+@timed_query
 async def get_bookings_for_day(target_date: date):
-    """Получает все записи на конкретную дату."""
+    """Получает все записи (start_time, user_name, capacity) на конкретную дату."""
     day_str = target_date.isoformat()
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().read() as db:
         query = """
-            SELECT s.start_time, b.user_name 
+            SELECT s.start_time, b.user_name, s.capacity
             FROM bookings b
             JOIN slots s ON b.slot_id = s.id
-            WHERE s.start_time LIKE ?
-            ORDER BY s.start_time ASC
+            WHERE s.day = ?
+            ORDER BY s.start_time ASC, b.id ASC
         """
-        cursor = await db.execute(query, (f"{day_str}%",))
+        cursor = await db.execute(query, (day_str,))
         return await cursor.fetchall()
 
 
-async def get_bookings_in_time_range(start_dt: datetime, end_dt: datetime):
+async def iter_bookings_export(start: date, end: date, batch_size: int = 500):
     """
-    Ищет записи, у которых start_time попадает в интервал [start_dt, end_dt].
-    Возвращает список кортежей (user_id, start_time, full_name).
+    Построчно отдает записи за дни start..end включительно, текущие и из архива:
+    (start_time, user_id, user_name, source), source — booking, hold или archive.
+    Строки читаются курсором пачками по batch_size, весь результат в память не попадает.
+    Пока генератор не закрыт, он держит соединение из пула читателей.
     """
-    start_str = start_dt.isoformat()
-    end_str = end_dt.isoformat()
-    async with aiosqlite.connect(DB_NAME) as db:
-        query = """
-            SELECT b.user_id, s.start_time, u.full_name
+    async with get_db().read() as db:
+        cursor = await db.execute("""
+            SELECT s.start_time, b.user_id, b.user_name,
+                   CASE WHEN b.confirm_by IS NULL THEN 'booking' ELSE 'hold' END
             FROM bookings b
             JOIN slots s ON b.slot_id = s.id
-            JOIN users u ON b.user_id = u.user_id
-            WHERE s.start_time >= ? AND s.start_time < ?
-        """
-        cursor = await db.execute(query, (start_str, end_str))
+            WHERE s.day BETWEEN ? AND ?
+            UNION ALL
+            SELECT start_time, user_id, user_name, 'archive'
+            FROM archive_bookings
+            WHERE day BETWEEN ? AND ?
+            ORDER BY 1
+        """, (start.isoformat(), end.isoformat()) * 2)
+        cursor.arraysize = batch_size
+        try:
+            async for row in cursor:
+                yield row
+        finally:
+            await cursor.close()
+
+
+class DaySummary(NamedTuple):
+    slots: int
+    booked: int
+    # Растет при любом изменении слотов дня; 0 — слотов на день не было.
+    version: int
+
+
+@timed_query
+async def get_day_summary(target_date: date) -> DaySummary:
+    """Сводка по дню из day_summary, которую ведут триггеры на slots: одно чтение по ключу."""
+    async with get_db().read() as db:
+        cursor = await db.execute(
+            "SELECT slots, booked, version FROM day_summary WHERE day = ?", (target_date.isoformat(),)
+        )
+        row = await cursor.fetchone()
+    return DaySummary(*row) if row else DaySummary(0, 0, 0)
+
+
+@timed_query
+async def get_upcoming_bookings():
+    """Возвращает (user_id, start_time) всех подтвержденных записей на будущие слоты."""
+    async with get_db().read() as db:
+        cursor = await db.execute("""
+            SELECT b.user_id, s.start_time
+            FROM bookings b
+            JOIN slots s ON b.slot_id = s.id
+            WHERE s.start_time > ? AND b.confirm_by IS NULL
+            ORDER BY s.start_time ASC
+        """, (datetime.now().isoformat(),))
         return await cursor.fetchall()
 
 
+@timed_query
+async def has_booking(user_id: int, start_time: str) -> bool:
+    """Проверяет, что у пользователя все еще есть запись на слот с этим start_time."""
+    async with get_db().read() as db:
+        cursor = await db.execute("""
+            SELECT 1 FROM bookings b
+            JOIN slots s ON b.slot_id = s.id
+            WHERE b.user_id = ? AND s.start_time = ?
+        """, (user_id, start_time))
+        return await cursor.fetchone() is not None
+
+
+@timed_query
+async def archive_finished_slots(now: datetime | None = None) -> int:
+    """
+    Переносит все завершившиеся слоты и их записи в архивные таблицы одной
+    транзакцией и удаляет их из рабочих. Обрабатывает и дни, пропущенные,
+    пока бот был выключен. Возвращает число перенесенных слотов.
+    """
+    now_iso = (now or datetime.now()).isoformat()
+    finished = "s.start_time < :now AND COALESCE(s.end_time, s.start_time) <= :now"
+    params = {"now": now_iso}
+    async with get_db().write() as db:
+        await db.execute(f"""
+            INSERT INTO archive_bookings (day, start_time, user_id, user_name)
+            SELECT s.day, s.start_time, b.user_id, b.user_name
+            FROM bookings b
+            JOIN slots s ON b.slot_id = s.id
+            WHERE {finished}
+            ORDER BY s.start_time, b.id
+        """, params)
+        await db.execute(f"""
+            INSERT OR REPLACE INTO archive_slots (start_time, day, booked)
+            SELECT s.start_time, s.day, s.booked_count FROM slots s
+            WHERE {finished}
+        """, params)
+        await db.execute(f"""
+            DELETE FROM bookings WHERE slot_id IN (
+                SELECT s.id FROM slots s WHERE {finished}
+            )
+        """, params)
+        await db.execute(f"""
+            DELETE FROM waitlist WHERE slot_id IN (
+                SELECT s.id FROM slots s WHERE {finished}
+            )
+        """, params)
+        cursor = await db.execute(f"DELETE FROM slots AS s WHERE {finished}", params)
+        moved = cursor.rowcount
+        # Отметки генератора о прошедших днях больше не нужны.
+        await db.execute("DELETE FROM schedule_materialized WHERE day < substr(:now, 1, 10)", params)
+        await db.execute("DELETE FROM schedule_exceptions WHERE day < substr(:now, 1, 10)", params)
+
+    if moved:
+        # Переносы освобождают много страниц — сжимаем WAL, пока нагрузки нет.
+        async with get_db().locked() as db:
+            await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return moved
+
+
+@timed_query
+async def purge_archive(retention_days: int) -> int:
+    """Удаляет из архива дни старше retention_days. Возвращает число удаленных записей."""
+    cutoff = (date.today() - timedelta(days=retention_days)).isoformat()
+    async with get_db().write() as db:
+        cursor = await db.execute("DELETE FROM archive_bookings WHERE day < ?", (cutoff,))
+        deleted = cursor.rowcount
+        await db.execute("DELETE FROM archive_slots WHERE day < ?", (cutoff,))
+    return deleted
+
+
+@timed_query
 async def clear_day_data(target_date: date):
     """Удаляет слоты и записи за конкретное число."""
     day_str = target_date.isoformat()
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().write() as db:
         await db.execute("""
             DELETE FROM bookings WHERE slot_id IN (
-                SELECT id FROM slots WHERE start_time LIKE ?
+                SELECT id FROM slots WHERE day = ?
             )
-        """, (f"{day_str}%",))
-        await db.execute(
-            "DELETE FROM slots WHERE start_time LIKE ?",
-            (f"{day_str}%",))
-        await db.commit()
+        """, (day_str,))
+        await db.execute("""
+            DELETE FROM waitlist WHERE slot_id IN (
+                SELECT id FROM slots WHERE day = ?
+            )
+        """, (day_str,))
+        await db.execute("DELETE FROM slots WHERE day = ?", (day_str,))
 
+    _availability.remove_day(target_date)
 
+
+@timed_query
 async def clear_all_bookings_and_slots():
     """Полная очистка всех записей и освобождение всех слотов."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().write() as db:
         await db.execute("DELETE FROM bookings")
+        await db.execute("DELETE FROM waitlist")
         await db.execute("DELETE FROM slots") 
-        await db.commit()
+        await db.execute("DELETE FROM schedule_materialized")
+
+    _availability.clear()
 
 
+@timed_query
 async def get_max_user_bookings() -> int:
     async with _settings_lock:
         if "max_user_bookings" in _settings_cache:
             return _settings_cache["max_user_bookings"]
         
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().read() as db:
         cursor = await db.execute(
             "SELECT value FROM settings_limits WHERE key = 'max_user_bookings'"
         )
         res = await cursor.fetchone()
 
-        if res is None:
-            value = DEFAULT_MAX_USER_BOOKINGS
-            await set_max_user_bookings(value)
-        else:
-            value = int(res[0])
+    if res is None:
+        value = DEFAULT_MAX_USER_BOOKINGS
+        await set_max_user_bookings(value)
+    else:
+        value = int(res[0])
     
     async with _settings_lock:
         _settings_cache["max_user_bookings"] = value
@@ -307,10 +1142,11 @@ async def get_max_user_bookings() -> int:
     return value
 
 
+@timed_query
 async def set_max_user_bookings(value: int):
     value = max(value, 1)
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db().write() as db:
         await db.execute(
             """
             INSERT INTO settings_limits (key, value)
@@ -319,7 +1155,6 @@ async def set_max_user_bookings(value: int):
             """,
             (value,)
         )
-        await db.commit()
 
     async with _settings_lock:
         _settings_cache["max_user_bookings"] = value
@@ -0,0 +1,65 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+
+from logger_config import logger
+
+
+class _PendingEdit:
+    __slots__ = ("send", "task", "sending")
+
+    def __init__(self, send: Callable[[], Awaitable[None]]):
+        self.send = send
+        self.task: asyncio.Task | None = None
+        self.sending = False
+
+
+class EditDebouncer:
+    """
+    Склеивает частые правки одного сообщения: первая правка запускает окно
+    delay секунд, последующие в этом окне лишь заменяют функцию отправки,
+    и по истечении окна уходит только последняя. flush() отправляет ожидающую
+    правку сразу (или дожидается уже начатой), чтобы за ней не пришла устаревшая.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending: dict[Hashable, _PendingEdit] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def schedule(self, key: Hashable, send: Callable[[], Awaitable[None]]):
+        if self.delay <= 0:
+            await send()
+            return
+        pending = self._pending.get(key)
+        if pending is not None and not pending.sending:
+            pending.send = send
+            return
+        pending = _PendingEdit(send)
+        self._pending[key] = pending
+        pending.task = asyncio.create_task(self._fire(key, pending))
+
+    async def _fire(self, key: Hashable, pending: _PendingEdit):
+        await asyncio.sleep(self.delay)
+        await self._send(key, pending)
+
+    async def _send(self, key: Hashable, pending: _PendingEdit):
+        pending.sending = True
+        try:
+            await pending.send()
+        except Exception as e:
+            logger.error(f"Не удалось применить отложенную правку {key}: {e}")
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+
+    async def flush(self, key: Hashable):
+        pending = self._pending.get(key)
+        if pending is None:
+            return
+        if pending.sending:
+            await asyncio.shield(pending.task)
+            return
+        pending.task.cancel()
+        await self._send(key, pending)
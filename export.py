@@ -0,0 +1,79 @@
+import contextlib
+import csv
+import gzip
+import tempfile
+from collections.abc import AsyncIterator
+from datetime import date, datetime
+
+from aiogram.types import InputFile
+
+from config import EXPORT_SPOOL_BYTES
+from db import iter_bookings_export
+
+# Telegram не принимает от ботов файлы больше 50 МБ.
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+CSV_HEADER = ("Дата", "Время", "ID", "Имя", "Статус")
+STATUSES = {"booking": "записан", "hold": "ждет подтверждения", "archive": "прошло"}
+
+
+class _Line:
+    """Файл для csv.writer, который возвращает строку вместо записи."""
+
+    def write(self, line: str) -> str:
+        return line
+
+
+async def csv_lines(rows: AsyncIterator[tuple]) -> AsyncIterator[str]:
+    """
+    Строки CSV по одной: заголовок с BOM (чтобы Excel понял кириллицу),
+    затем по строке на запись из iter_bookings_export.
+    """
+    writer = csv.writer(_Line())
+    yield "\ufeff" + writer.writerow(CSV_HEADER)
+    async for start_time_iso, user_id, user_name, source in rows:
+        dt = datetime.fromisoformat(start_time_iso)
+        yield writer.writerow((dt.strftime("%d.%m.%Y"), dt.strftime("%H:%M"), user_id,
+                               user_name or "", STATUSES.get(source, source)))
+
+
+class SpooledInputFile(InputFile):
+    """Отдает aiogram содержимое временного файла кусками, не читая его целиком."""
+
+    def __init__(self, file: tempfile.SpooledTemporaryFile, filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    def size(self) -> int:
+        self.file.seek(0, 2)
+        return self.file.tell()
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+async def export_bookings(start: date, end: date, compress: bool = False) -> tuple[SpooledInputFile, int]:
+    """
+    Пишет записи за start..end в CSV, по желанию сжатый gzip. Строки идут
+    из курсора через генератор прямо во временный файл: до EXPORT_SPOOL_BYTES
+    он в памяти, дальше на диске. Возвращает файл и число записей;
+    закрыть файл (result.file.close()) должен вызывающий.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    out = gzip.GzipFile(fileobj=spool, mode="wb") if compress else spool
+    lines = -1
+    try:
+        async with contextlib.aclosing(iter_bookings_export(start, end)) as rows:
+            async for line in csv_lines(rows):
+                out.write(line.encode("utf-8"))
+                lines += 1
+        if compress:
+            out.close()
+    except BaseException:
+        spool.close()
+        raise
+
+    filename = f"bookings_{start.isoformat()}_{end.isoformat()}.csv" + (".gz" if compress else "")
+    return SpooledInputFile(spool, filename), lines
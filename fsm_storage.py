@@ -0,0 +1,116 @@
+import json
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from db import get_db
+
+
+def _encode(data: Mapping[str, Any]) -> str | None:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_encode_value)
+
+
+def _encode_value(value):
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": sorted(value)}
+    raise TypeError(f"Значение {type(value).__name__} нельзя сохранить в FSM")
+
+
+def _decode_value(obj: dict):
+    if len(obj) == 1 and "__set__" in obj:
+        return set(obj["__set__"])
+    return obj
+
+
+def _decode(raw: str | None) -> dict[str, Any]:
+    if not raw:
+        return {}
+    return json.loads(raw, object_hook=_decode_value)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_states той же базы SQLite.
+    Состояние и данные хранятся одной строкой на ключ; данные — компактный JSON
+    (множества сохраняются как {"__set__": [...]}). Пустые записи удаляются.
+    """
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id,
+            key.thread_id or "",
+            getattr(key, "business_connection_id", None) or "",
+            key.destiny,
+        ))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        async with get_db().write() as db:
+            await db.execute("""
+                INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            """, (self._key(key), value, time.time()))
+            await db.execute(
+                "DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data IS NULL",
+                (self._key(key),)
+            )
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        async with get_db().read() as db:
+            cursor = await db.execute("SELECT state FROM fsm_states WHERE key = ?", (self._key(key),))
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with get_db().write() as db:
+            await db.execute("""
+                INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """, (self._key(key), _encode(data), time.time()))
+            await db.execute(
+                "DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data IS NULL",
+                (self._key(key),)
+            )
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        async with get_db().read() as db:
+            cursor = await db.execute("SELECT data FROM fsm_states WHERE key = ?", (self._key(key),))
+            row = await cursor.fetchone()
+            return _decode(row[0] if row else None)
+
+    async def toggle_bits(self, key: StorageKey, field: str, bits: int) -> dict[str, Any] | None:
+        """
+        Переключает биты bits в целочисленном поле field данных одним UPDATE
+        под писателем, без чтения в Python: одновременные нажатия, в том числе
+        из разных воркеров, не затирают друг друга. Возвращает новые данные
+        или None, если записи нет или поле не целое.
+        """
+        path = f"$.{field}"
+        async with get_db().write() as db:
+            cursor = await db.execute("""
+                UPDATE fsm_states
+                SET data = json_set(data, :path, (json_extract(data, :path) | :bits)
+                                                 - (json_extract(data, :path) & :bits)),
+                    updated_at = :now
+                WHERE key = :key AND json_type(data, :path) = 'integer'
+                RETURNING data
+            """, {"path": path, "bits": bits, "now": time.time(), "key": self._key(key)})
+            row = await cursor.fetchone()
+        return _decode(row[0]) if row else None
+
+    async def expire(self, ttl_seconds: float) -> int:
+        """Удаляет состояния, не менявшиеся дольше ttl_seconds. Возвращает число удаленных."""
+        async with get_db().write() as db:
+            cursor = await db.execute(
+                "DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - ttl_seconds,)
+            )
+            return cursor.rowcount
+
+    async def close(self) -> None:
+        # Соединения принадлежат db.py и закрываются через close_db().
+        pass
@@ -1,19 +1,30 @@
 from aiogram import Bot
 from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 from datetime import date, timedelta, time, datetime
 from logger_config import logger
 import contextlib
+import time as time_module
 
 from filters import IsAdmin
-from keyboards import days_keyboard, slots_tickbox
-from db import (add_slots_for_day, get_slots_on_day,
-                delete_slot_by_time, get_all_bookings_report,
-                clear_all_bookings_and_slots, set_max_user_bookings)
+from broadcast import broadcast, OutgoingMessage
+from debounce import EditDebouncer
+from keyboards import days_keyboard, slots_tickbox, pager_keyboard
+from db import (set_day_slots, get_slots_on_day, get_bookings_page,
+                clear_all_bookings_and_slots, set_max_user_bookings,
+                get_schedule_template, set_template_weekday, TemplateEntry,
+                get_schedule_exceptions, set_schedule_exception, materialize_schedule,
+                set_slot_capacity)
 from states import AdminAddSlots
+from fsm_storage import SQLiteStorage
+from reminders import cancel_reminder, cancel_all_reminders
+from waitlist import notify_promotions
+from config import ADMIN_EDIT_DEBOUNCE, SCHEDULE_WEEKS_AHEAD, SLOT_CAPACITY
+from notifications import schedule_diff_text, day_report, day_overview_text
+from export import export_bookings, MAX_DOCUMENT_BYTES
 
 router = Router()
 router.message.filter(IsAdmin())
@@ -23,14 +34,58 @@ ADMIN_MENU = (
     "👑 **Админ-панель**\n\n"
     "/editslots — Управление расписанием (добавить/удалить слоты)\n\n"
     "/setmaxbookings <n> — Установка лимита записей для одного пользователя\n\n"
-    "/all — Просмотреть все записи пользователей"
+    "/all [ДД.ММ] [ID] — Просмотреть записи пользователей\n\n"
+    "/day [ДД.ММ] — Сводка за день\n\n"
+    "/export [ДД.ММ] [ДД.ММ] [gz] — Выгрузить записи в CSV\n\n"
+    "/template — Недельный шаблон расписания\n\n"
+    "/publish [недель] — Создать слоты по шаблону\n\n"
+    "/skip ДД.ММ, /unskip ДД.ММ — Исключить день из шаблона или вернуть\n\n"
+    "/seats ДД.ММ ЧЧ:ММ N — Число мест в слоте"
 )
 
+WEEKDAYS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+TEMPLATE_USAGE = (
+    "Использование:\n"
+    "/template пн 11:30 12:30 18:00/90x8 — времена дня недели "
+    "(через / длительность в минутах, по умолчанию 60; через x число мест)\n"
+    "/template пн - — убрать день из шаблона"
+)
+
+ALL_PAGE_ROWS = 40
+MESSAGE_LIMIT = 4000
+
 
 def get_admin_time_slots():
     return [time(hour=h, minute=30) for h in range(11, 22)]
 
 
+# Сетка времен считается один раз; выбор админа хранится в FSM битовой маской по ней.
+ADMIN_GRID = tuple(t.strftime("%H:%M") for t in get_admin_time_slots())
+ADMIN_GRID_BITS = {t_str: 1 << i for i, t_str in enumerate(ADMIN_GRID)}
+
+# Правки клавиатуры галочек по (chat_id, message_id).
+toggle_edits = EditDebouncer(ADMIN_EDIT_DEBOUNCE)
+
+
+def grid_mask(times) -> int:
+    mask = 0
+    for t_str in times:
+        mask |= ADMIN_GRID_BITS.get(t_str, 0)
+    return mask
+
+
+def grid_times(mask: int) -> list[str]:
+    return [t_str for t_str, bit in ADMIN_GRID_BITS.items() if mask & bit]
+
+
+def _selection_from_state(data: dict) -> tuple[int, list[str]]:
+    """Маска выбранных времен и времена вне сетки; понимает и старый формат с множеством selected."""
+    if "selected" in data:
+        selected = data["selected"]
+        return grid_mask(selected), sorted(t for t in selected if t not in ADMIN_GRID_BITS)
+    return data.get("mask", 0), data.get("extra", [])
+
+
 def escape_md(text: str) -> str:
     escape_chars = r'_*[]()~`>#+-=|{}.!'
     return ''.join(f'\\{char}' if char in escape_chars else char for char in text)
@@ -55,20 +110,18 @@ async def admin_choose_day(callback: CallbackQuery, state: FSMContext):
     day_date = date.fromisoformat(day_str)
 
     existing_slots_iso = await get_slots_on_day(day_date)
-    
-    selected = set()
-    for iso_str in existing_slots_iso:
-        dt = datetime.fromisoformat(iso_str)
-        selected.add(dt.strftime("%H:%M"))
+    # start_time в ISO: время HH:MM — символы 11..16, без разбора даты.
+    existing = [iso_str[11:16] for iso_str in existing_slots_iso]
+    mask = grid_mask(existing)
+    # Слоты вне сетки не показываются, но и не удаляются при подтверждении.
+    extra = [t_str for t_str in existing if t_str not in ADMIN_GRID_BITS]
 
-    await state.update_data(day=day_str, selected=selected)
+    await state.update_data(day=day_str, mask=mask, extra=extra)
     await state.set_state(AdminAddSlots.choosing_slots)
     
-    slots = get_admin_time_slots()
-    
     await callback.message.edit_text(
         f"🕒 Редактирование {day_str}.\nСнимите галочку, чтобы удалить слот (и запись!):", 
-        reply_markup=slots_tickbox(slots, selected)
+        reply_markup=slots_tickbox(ADMIN_GRID, mask)
     )
     await callback.answer()
 
@@ -76,61 +129,55 @@ async def admin_choose_day(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(AdminAddSlots.choosing_slots, F.data.startswith("toggle:"))
 async def toggle_slot(callback: CallbackQuery, state: FSMContext):
     t_str = callback.data.split(":", 1)[1]
-    data = await state.get_data()
-    selected = data.get("selected", set())
+    bit = ADMIN_GRID_BITS.get(t_str, 0)
+    # Маску меняем в базе одним UPDATE: get_data → set_data терял бы одновременные
+    # нажатия, обработанные параллельно в этом или в другом воркере.
+    if not (isinstance(state.storage, SQLiteStorage)
+            and await state.storage.toggle_bits(state.key, "mask", bit) is not None):
+        data = await state.get_data()
+        mask, extra = _selection_from_state(data)
+        await state.set_data({"day": data.get("day"), "mask": mask ^ bit, "extra": extra})
+    await callback.answer()
 
-    if t_str in selected:
-        selected.remove(t_str)
-    else:
-        selected.add(t_str)
+    message = callback.message
 
-    await state.update_data(selected=selected)
-    slots = get_admin_time_slots()
-    
-    with contextlib.suppress(TelegramBadRequest):
-        await callback.message.edit_reply_markup(
-            reply_markup=slots_tickbox(slots, selected)
-        )
-    await callback.answer()
+    async def send_markup():
+        # Галочки берем из FSM в момент отправки: так уходит итог всех нажатий окна.
+        current_mask, _ = _selection_from_state(await state.get_data())
+        with contextlib.suppress(TelegramBadRequest):
+            await message.edit_reply_markup(reply_markup=slots_tickbox(ADMIN_GRID, current_mask))
+
+    await toggle_edits.schedule((message.chat.id, message.message_id), send_markup)
 
 
 @router.callback_query(AdminAddSlots.choosing_slots, F.data == "confirm_slots")
 async def confirm_slots(callback: CallbackQuery, state: FSMContext, bot: Bot):
     admin_id = callback.from_user.id
+    # Отложенная правка галочек не должна прийти после итогового текста.
+    await toggle_edits.flush((callback.message.chat.id, callback.message.message_id))
     data = await state.get_data()
-    selected_set = data.get("selected", set())
+    mask, extra = _selection_from_state(data)
     day_str = data.get("day")
     day = date.fromisoformat(day_str)
 
-    existing_slots_iso = await get_slots_on_day(day)
-    existing_set = {datetime.fromisoformat(iso).strftime("%H:%M") for iso in existing_slots_iso}
-
-    to_add = selected_set - existing_set
-    to_delete = existing_set - selected_set
-
-    added, deleted, notified = 0, 0, 0
-
-    for t_str in to_add:
-        t = datetime.strptime(t_str, "%H:%M").time()
-        start = datetime.combine(day, t)
-        await add_slots_for_day(start, start + timedelta(hours=1))
-        added += 1
-
-    for t_str in to_delete:
-        t = datetime.strptime(t_str, "%H:%M").time()
-        start_dt = datetime.combine(day, t)
-        user_id = await delete_slot_by_time(start_dt.isoformat())
-        deleted += 1
-        if user_id:
-            logger.info(f"ОТМЕНА: (АДМИН) Пользователь {user_id} на {start_dt.strftime('%d.%m в %H:%M')}")
-            try:
-                await bot.send_message(
-                    user_id, 
-                    f"⚠️ Ваша запись на **{start_dt.strftime('%d.%m в %H:%M')}** была отменена администратором.",
-                    parse_mode="Markdown"
-                )
-                notified += 1
-            except Exception: pass
+    times = {time.fromisoformat(t_str) for t_str in grid_times(mask) + extra}
+    started = time_module.perf_counter()
+    diff = await set_day_slots(day, times)
+    duration_ms = round((time_module.perf_counter() - started) * 1000, 2)
+    added, deleted = len(diff.added), len(diff.deleted)
+
+    messages = []
+    for user_id, start_time_iso in diff.displaced:
+        start_dt = datetime.fromisoformat(start_time_iso)
+        cancel_reminder(user_id, start_time_iso)
+        logger.info(f"ОТМЕНА: (АДМИН) Пользователь {user_id} на {start_dt.strftime('%d.%m в %H:%M')}", extra={
+            "user_id": user_id, "slot": start_time_iso, "action": "admin_cancel"
+        })
+        messages.append(OutgoingMessage(
+            user_id,
+            f"⚠️ Ваша запись на **{start_dt.strftime('%d.%m в %H:%M')}** была отменена администратором."
+        ))
+    notified = (await broadcast(bot, messages)).delivered
 
     await state.clear()
     
@@ -140,30 +187,287 @@ async def confirm_slots(callback: CallbackQuery, state: FSMContext, bot: Bot):
         f"➖ Удалено: {deleted}\n"
         f"🔔 Уведомлено пользователей: {notified}"
     )
-    logger.info(f"АДМИН ({admin_id}): Изменены слоты на {day_str} (добавлено {added}, удалено {deleted})")
+    logger.info(f"АДМИН ({admin_id}): Изменены слоты на {day_str} (добавлено {added}, удалено {deleted})", extra={
+        "user_id": admin_id, "slot": day_str, "action": "edit_slots", "duration_ms": duration_ms
+    })
 
     await callback.message.edit_text(result_text, parse_mode="Markdown")
     await callback.message.answer(ADMIN_MENU, parse_mode="Markdown")
     await callback.answer()
 
 
+def _parse_day(arg: str) -> date:
+    """ДД.ММ (текущий год) или ГГГГ-ММ-ДД."""
+    if "-" in arg:
+        return date.fromisoformat(arg)
+    # Не strptime("%d.%m"): без года он берет 1900-й, и 29.02 не разбирается.
+    day_str, _, month_str = arg.partition(".")
+    return date(date.today().year, int(month_str), int(day_str))
+
+
+def _parse_all_filters(args: str | None) -> tuple[date | None, int | None]:
+    """Разбирает аргументы /all: дата (ДД.ММ или ГГГГ-ММ-ДД) и/или user_id."""
+    day, user_id = None, None
+    for arg in (args or "").split():
+        if arg.isdigit():
+            user_id = int(arg)
+        else:
+            day = _parse_day(arg)
+    return day, user_id
+
+
+def _page_data(direction: str, key: tuple[str, int], day: date | None, user_id: int | None) -> str:
+    return f"allp|{direction}|{key[0]}|{key[1]}|{day.isoformat() if day else ''}|{user_id or ''}"
+
+
+async def _render_bookings_page(day: date | None, user_id: int | None,
+                                after: tuple[str, int] | None = None,
+                                before: tuple[str, int] | None = None):
+    """
+    Рендерит одну страницу /all не длиннее MESSAGE_LIMIT символов.
+    Возвращает текст и клавиатуру «назад/далее» с ключами первой и последней строки.
+    """
+    rows = await get_bookings_page(ALL_PAGE_ROWS + 1, after=after, before=before,
+                                   day=day, user_id=user_id)
+    if before is not None:
+        has_prev, has_next = len(rows) > ALL_PAGE_ROWS, True
+        rows = rows[-ALL_PAGE_ROWS:]
+    else:
+        has_prev, has_next = after is not None, len(rows) > ALL_PAGE_ROWS
+        rows = rows[:ALL_PAGE_ROWS]
+
+    if not rows:
+        return None, None
+
+    report = "📋 **Список всех записей:**\n"
+    current_day = ""
+    shown = 0
+    for start_time_iso, user_info, _ in rows:
+        dt = datetime.fromisoformat(start_time_iso)
+        day_str = dt.strftime("%d.%m (%a)")
+        chunk = ""
+        if day_str != current_day:
+            chunk += f"\n📅 {day_str}\n"
+        chunk += f"  • {dt.strftime('%H:%M')} — {escape_md(user_info or '')}\n"
+        if shown and len(report) + len(chunk) > MESSAGE_LIMIT:
+            has_next = True
+            break
+        report += chunk
+        current_day = day_str
+        shown += 1
+
+    first, last = rows[0], rows[shown - 1]
+    markup = pager_keyboard(
+        _page_data("p", (first[0], first[2]), day, user_id) if has_prev else None,
+        _page_data("n", (last[0], last[2]), day, user_id) if has_next else None,
+    )
+    return report, markup
+
+
 @router.message(Command("all"))
-async def show_all_bookings(message: Message):
-    bookings = await get_all_bookings_report()
-    if not bookings:
+async def show_all_bookings(message: Message, command: CommandObject):
+    try:
+        day, user_id = _parse_all_filters(command.args)
+    except ValueError:
+        await message.answer("Использование: /all [ДД.ММ] [user_id]")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+    report, markup = await _render_bookings_page(day, user_id)
+    if report is None:
         await message.answer("📭 Записей пока нет.")
     else:
-        report = "📋 **Список всех записей:**\n"
-        current_day = ""
-        for start_time_iso, user_info in bookings:
-            dt = datetime.fromisoformat(start_time_iso)
-            day_str = dt.strftime("%d.%m (%a)")
-            if day_str != current_day:
-                report += f"\n📅 {day_str}\n"
-                current_day = day_str
-            user_info = escape_md(user_info)
-            report += f"  • {dt.strftime('%H:%M')} — {user_info}\n"
-        await message.answer(report, parse_mode="Markdown")
+        await message.answer(report, parse_mode="Markdown", reply_markup=markup)
+    await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+
+@router.callback_query(F.data.startswith("allp|"))
+async def show_bookings_page(callback: CallbackQuery):
+    _, direction, start_time, booking_id, day_str, user_str = callback.data.split("|")
+    key = (start_time, int(booking_id))
+    day = date.fromisoformat(day_str) if day_str else None
+    user_id = int(user_str) if user_str else None
+
+    if direction == "n":
+        report, markup = await _render_bookings_page(day, user_id, after=key)
+    else:
+        report, markup = await _render_bookings_page(day, user_id, before=key)
+
+    if report is None:
+        await callback.answer("Больше записей нет.")
+        return
+    with contextlib.suppress(TelegramBadRequest):
+        await callback.message.edit_text(report, parse_mode="Markdown", reply_markup=markup)
+    await callback.answer()
+
+
+def _parse_template_entries(args: list[str]) -> list[TemplateEntry]:
+    entries = {}
+    for arg in args:
+        arg, _, capacity_str = arg.lower().partition("x")
+        start_str, _, minutes_str = arg.partition("/")
+        start = time.fromisoformat(start_str.zfill(5))
+        minutes = int(minutes_str) if minutes_str else 60
+        capacity = int(capacity_str) if capacity_str else SLOT_CAPACITY
+        if minutes <= 0 or capacity <= 0:
+            raise ValueError(arg)
+        entries[start] = TemplateEntry(start, timedelta(minutes=minutes), capacity)
+    return [entries[start] for start in sorted(entries)]
+
+
+async def _template_text() -> str:
+    template = await get_schedule_template()
+    if not template:
+        return "🗓 Шаблон расписания пуст.\n\n" + TEMPLATE_USAGE
+    lines = ["🗓 **Недельный шаблон:**"]
+    for weekday, entries in sorted(template.items()):
+        times = ", ".join(
+            e.start.strftime("%H:%M")
+            + ("" if e.duration == timedelta(hours=1) else f"/{int(e.duration.total_seconds() // 60)}")
+            + (f"x{e.capacity}" if e.capacity > 1 else "")
+            for e in entries
+        )
+        lines.append(f"{WEEKDAYS[weekday]}: {times}")
+    skipped = await get_schedule_exceptions(date.today())
+    if skipped:
+        lines.append("\n⏭ Исключения: " + ", ".join(day.strftime("%d.%m") for day in skipped))
+    return "\n".join(lines)
+
+
+@router.message(Command("template"))
+async def cmd_template(message: Message, command: CommandObject):
+    args = (command.args or "").split()
+    if args:
+        weekday_str = args[0].lower()
+        try:
+            if weekday_str not in WEEKDAYS or len(args) < 2:
+                raise ValueError(weekday_str)
+            entries = [] if args[1:] == ["-"] else _parse_template_entries(args[1:])
+        except ValueError:
+            await message.answer(TEMPLATE_USAGE)
+            return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+        diff = await set_template_weekday(WEEKDAYS.index(weekday_str), entries)
+        logger.info(f"АДМИН ({message.from_user.id}): Шаблон на {weekday_str}: {len(entries)} времен", extra={
+            "user_id": message.from_user.id, "action": "edit_template"
+        })
+        if diff.added:
+            await message.answer(schedule_diff_text(diff), parse_mode="Markdown")
+    await message.answer(await _template_text(), parse_mode="Markdown")
+    await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+
+@router.message(Command("publish"))
+async def cmd_publish(message: Message, command: CommandObject):
+    arg = (command.args or "").strip()
+    if arg and not arg.isdigit():
+        await message.answer("Использование: /publish [число недель]")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+    weeks = int(arg) if arg else (SCHEDULE_WEEKS_AHEAD or 4)
+
+    started = time_module.perf_counter()
+    diff = await materialize_schedule(weeks)
+    duration_ms = round((time_module.perf_counter() - started) * 1000, 2)
+    added = sum(len(times) for times in diff.added.values())
+    logger.info(f"АДМИН ({message.from_user.id}): Опубликовано по шаблону {added} слотов на {weeks} нед.", extra={
+        "user_id": message.from_user.id, "action": "publish", "duration_ms": duration_ms
+    })
+    await message.answer(schedule_diff_text(diff), parse_mode="Markdown")
+    await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+
+@router.message(Command("skip", "unskip"))
+async def cmd_skip_day(message: Message, command: CommandObject):
+    skip = command.command == "skip"
+    try:
+        day = _parse_day((command.args or "").strip())
+    except ValueError:
+        await message.answer(f"Использование: /{command.command} ДД.ММ")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+    await set_schedule_exception(day, skip)
+    if skip:
+        text = f"⏭ {day.strftime('%d.%m')} исключен из шаблона. Уже созданные слоты удалите через /editslots."
+    else:
+        text = f"✅ {day.strftime('%d.%m')} снова генерируется по шаблону (при следующем /publish)."
+    await message.answer(text)
+    await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+
+@router.message(Command("seats"))
+async def cmd_set_seats(message: Message, command: CommandObject):
+    try:
+        day_arg, time_arg, capacity_arg = (command.args or "").split()
+        start = datetime.combine(_parse_day(day_arg), time.fromisoformat(time_arg.zfill(5)))
+        capacity = int(capacity_arg)
+        if capacity <= 0:
+            raise ValueError(capacity_arg)
+    except ValueError:
+        await message.answer("Использование: /seats ДД.ММ ЧЧ:ММ число")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+    change = await set_slot_capacity(start.isoformat(), capacity)
+    slot_str = start.strftime("%d.%m в %H:%M")
+    if change is None:
+        await message.answer(f"Слота на {slot_str} нет.")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+    booked, promotions = change
+    if booked > capacity:
+        await message.answer(f"⚠ На {slot_str} уже записано {booked}, меньше мест сделать нельзя.")
+    else:
+        text = f"✅ Мест на {slot_str}: {capacity} (записано {booked})."
+        if promotions:
+            text += f"\n🕓 Из очереди предложено мест: {len(promotions)}."
+        await message.answer(text)
+    await message.answer(ADMIN_MENU, parse_mode="Markdown")
+    await notify_promotions(message.bot, promotions)
+
+
+@router.message(Command("day"))
+async def cmd_day_overview(message: Message, command: CommandObject):
+    try:
+        day = _parse_day(command.args.strip()) if command.args else date.today()
+    except ValueError:
+        await message.answer("Использование: /day [ДД.ММ]")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+    await message.answer(await day_report(day, day_overview_text), parse_mode="Markdown")
+    await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    args = (command.args or "").lower().split()
+    compress = "gz" in args
+    day_args = [arg for arg in args if arg != "gz"]
+    try:
+        if len(day_args) > 2:
+            raise ValueError(command.args)
+        days = [_parse_day(arg) for arg in day_args]
+        start, end = (days[0], days[-1]) if days else (date.today(), date.today())
+        # /export 01.12 15.01 — период через Новый год; с явным годом не угадываем.
+        if end < start and "-" not in day_args[-1]:
+            end = end.replace(year=end.year + 1)
+        if end < start:
+            raise ValueError(command.args)
+    except ValueError:
+        await message.answer("Использование: /export [с ДД.ММ] [по ДД.ММ] [gz]")
+        return await message.answer(ADMIN_MENU, parse_mode="Markdown")
+
+    started = time_module.perf_counter()
+    document, rows = await export_bookings(start, end, compress)
+    try:
+        period = start.strftime("%d.%m.%Y") + (f" — {end.strftime('%d.%m.%Y')}" if end != start else "")
+        if not rows:
+            await message.answer(f"📭 За {period} записей нет.")
+        elif document.size() > MAX_DOCUMENT_BYTES:
+            await message.answer("⚠ Файл больше 50 МБ: сократите период или добавьте gz.")
+        else:
+            await message.answer_document(document, caption=f"📤 Записи за {period}: {rows}")
+        logger.info(f"ВЫГРУЗКА: {rows} записей за {period}", extra={
+            "user_id": message.from_user.id, "action": "export",
+            "duration_ms": round((time_module.perf_counter() - started) * 1000, 2)
+        })
+    finally:
+        document.file.close()
     await message.answer(ADMIN_MENU, parse_mode="Markdown")
 
 
@@ -185,6 +489,7 @@ async def cmd_set_max_bookings(message: Message):
 @router.message(Command("forceclearall"))
 async def cmd_clear_all(message: Message):
     await clear_all_bookings_and_slots()
+    cancel_all_reminders()
     await message.answer(
         "🗑 **Все записи аннулированы.**\n"
         "Таблица бронирований очищена, все слоты снова свободны.",
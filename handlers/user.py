@@ -2,20 +2,28 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+import time
 from datetime import date, datetime
 
 from logger_config import logger
-from keyboards import days_keyboard, slots_keyboard, bookings_keyboard
+from keyboards import (days_keyboard, slots_keyboard, bookings_keyboard,
+                       waitlist_offer_keyboard, waitlist_keyboard)
 from states import UserRegistration
+from reminders import schedule_reminder, cancel_reminder
+from throttling import ThrottlingMiddleware
+from waitlist import notify_promotions, cancel_hold_timer
 from db import (
-    get_free_slots, book_slot_safe, get_user_bookings, 
+    get_free_days, get_free_slots_on_day, book_slot_safe, get_user_bookings, 
     cancel_booking, set_user_name, get_user_name,
-    get_slot_time_str, get_booking_start_time,
-    count_user_bookings, get_max_user_bookings
+    get_booking_start_time, BookingStatus,
+    join_waitlist, leave_waitlist, WaitlistStatus, confirm_hold, expire_hold
 )
 
 
 router = Router()
+throttling = ThrottlingMiddleware()
+router.message.outer_middleware(throttling)
+router.callback_query.outer_middleware(throttling)
 
 START_TEXT = (
     "👋 **Главное меню**\n\n"
@@ -81,12 +89,11 @@ async def new_booking(message: Message):
     if not await check_registration(message): 
         return
     
-    slots = await get_free_slots()
-    if not slots:
+    unique_days = await get_free_days()
+    if not unique_days:
         await message.answer("😔 Свободных окон пока нет.")
         return await message.answer(START_TEXT, parse_mode="Markdown")
     
-    unique_days = sorted({datetime.fromisoformat(s[1]).date() for s in slots})
     await message.answer("📅 Выберите дату занятия:", reply_markup=days_keyboard(unique_days, "user_day"))
 
 
@@ -107,8 +114,7 @@ async def my_bookings(message: Message):
 async def user_choose_day(callback: CallbackQuery):
     day_str = callback.data.split(":")[1]
     selected_day = date.fromisoformat(day_str)
-    slots = await get_free_slots()
-    day_slots = [s for s in slots if datetime.fromisoformat(s[1]).date() == selected_day]
+    day_slots = await get_free_slots_on_day(selected_day)
     
     if not day_slots:
         await callback.message.edit_text("😔 К сожалению, на этот день доступных окон нет.")
@@ -124,36 +130,51 @@ async def user_choose_day(callback: CallbackQuery):
 async def do_booking(callback: CallbackQuery):
     
     slot_id = int(callback.data.split(":")[1])
+    await _book_and_reply(callback, slot_id)
+
+
+async def _book_and_reply(callback: CallbackQuery, slot_id: int):
     user_id = callback.from_user.id
 
-    active_bookings_count = await count_user_bookings(user_id)
-    MAX_USER_BOOKINGS = await get_max_user_bookings()
-    
-    if active_bookings_count >= MAX_USER_BOOKINGS:
+    started = time.perf_counter()
+    result = await book_slot_safe(user_id, slot_id)
+    duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    slot_time = (
+        datetime.fromisoformat(result.start_time).strftime("%d.%m в %H:%M")
+        if result.start_time else "неизвестное время"
+    )
+
+    if result.status == BookingStatus.SUCCESS:
+        schedule_reminder(user_id, result.start_time)
+        await callback.message.edit_text(f"✅ Вы успешно записаны на **{slot_time}**!", parse_mode="Markdown")
+        logger.info(f"ЗАПИСЬ: Пользователь {user_id} на {slot_time}", extra={
+            "user_id": user_id, "slot": result.start_time, "action": "book", "duration_ms": duration_ms
+        })
+
+    elif result.status == BookingStatus.ALREADY_YOURS:
+        await callback.answer("Вы уже записаны на это время!", show_alert=False)
+        await callback.message.edit_text(f"✅ Вы уже записаны на **{slot_time}**.", parse_mode="Markdown")
+
+    elif result.status == BookingStatus.LIMIT_REACHED:
         await callback.message.edit_text(
             "🛑 Превышен лимит записей!\n\n"
-            f"Вы можете иметь не более {MAX_USER_BOOKINGS} активных записей одновременно."
+            f"Вы можете иметь не более {result.limit} активных записей одновременно."
         )
-    else:
 
-        user_name = await get_user_name(user_id)
-        slot_time = await get_slot_time_str(slot_id)
-
-        result = await book_slot_safe(user_id, slot_id, user_name)
-
-        if result == "success":
-            await callback.message.edit_text(f"✅ Вы успешно записаны на **{slot_time}**!", parse_mode="Markdown")
-            logger.info(f"ЗАПИСЬ: Пользователь {user_id} на {slot_time}")
-        
-        elif result == "already_yours":
-            await callback.answer("Вы уже записаны на это время!", show_alert=False)
-            await callback.message.edit_text(f"✅ Вы уже записаны на **{slot_time}**.", parse_mode="Markdown")
-        
-        elif result == "taken_by_other":
-            await callback.message.edit_text(f"⚠ Извините, время **{slot_time}** только что занял другой человек.")
-        
-        else:
-            await callback.message.edit_text("❌ Произошла ошибка при бронировании.")
+    elif result.status == BookingStatus.TAKEN_BY_OTHER:
+        await callback.message.edit_text(
+            f"⚠ Извините, время **{slot_time}** только что занял другой человек.\n"
+            "Можно встать в очередь: если место освободится, оно достанется вам.",
+            parse_mode="Markdown",
+            reply_markup=waitlist_offer_keyboard(slot_id)
+        )
+        return await callback.answer()
+
+    elif result.status in (BookingStatus.EXPIRED, BookingStatus.NOT_FOUND):
+        await callback.message.edit_text("⚠ Это время уже недоступно для записи.")
+
+    else:
+        await callback.message.edit_text("❌ Произошла ошибка при бронировании.")
 
     await callback.message.answer(START_TEXT, parse_mode="Markdown")
     await callback.answer()
@@ -163,7 +184,7 @@ async def do_booking(callback: CallbackQuery):
 async def user_cancel(callback: CallbackQuery):
     booking_id = int(callback.data.split(":")[1])
     user_id = callback.from_user.id
-    start_time_iso = await get_booking_start_time(booking_id)
+    start_time_iso = await get_booking_start_time(booking_id, user_id)
     
     if not start_time_iso:
         await callback.answer("Запись не найдена (возможно, уже удалена).", show_alert=True)
@@ -181,14 +202,94 @@ async def user_cancel(callback: CallbackQuery):
         )
         return
 
-    await cancel_booking(booking_id)
+    started = time.perf_counter()
+    promotions = await cancel_booking(booking_id, user_id)
+    duration_ms = round((time.perf_counter() - started) * 1000, 2)
+    cancel_reminder(user_id, start_time_iso)
+    cancel_hold_timer(booking_id)
     
     formatted_time = start_dt.strftime("%d.%m в %H:%M")
     await callback.message.edit_text(
         f"✅ Запись на **{formatted_time}** успешно отменена.", 
         parse_mode="Markdown"
     )
-    logger.info(f"ОТМЕНА: Пользователь {user_id} отменил {formatted_time}")
+    logger.info(f"ОТМЕНА: Пользователь {user_id} отменил {formatted_time}", extra={
+        "user_id": user_id, "slot": start_time_iso, "action": "cancel", "duration_ms": duration_ms
+    })
     
     await callback.message.answer(START_TEXT, parse_mode="Markdown")
-    await callback.answer()
\ No newline at end of file
+    await callback.answer()
+    await notify_promotions(callback.bot, promotions)
+
+
+@router.callback_query(F.data.startswith("wait:"))
+async def join_wait(callback: CallbackQuery):
+    slot_id = int(callback.data.split(":")[1])
+    user_id = callback.from_user.id
+    result = await join_waitlist(user_id, slot_id)
+
+    if result.status == WaitlistStatus.SEAT_AVAILABLE:
+        return await _book_and_reply(callback, slot_id)
+
+    slot_time = (
+        datetime.fromisoformat(result.start_time).strftime("%d.%m в %H:%M")
+        if result.start_time else "неизвестное время"
+    )
+    if result.status in (WaitlistStatus.JOINED, WaitlistStatus.ALREADY_WAITING):
+        await callback.message.edit_text(
+            f"🕓 Вы в очереди на **{slot_time}**, ваш номер: {result.position}.\n"
+            "Как только место освободится, мы напишем.",
+            parse_mode="Markdown",
+            reply_markup=waitlist_keyboard(slot_id)
+        )
+        if result.status == WaitlistStatus.JOINED:
+            logger.info(f"ОЧЕРЕДЬ: Пользователь {user_id} ждет {slot_time}", extra={
+                "user_id": user_id, "slot": result.start_time, "action": "waitlist_join"
+            })
+    elif result.status == WaitlistStatus.ALREADY_BOOKED:
+        await callback.message.edit_text(f"✅ Вы уже записаны на **{slot_time}**.", parse_mode="Markdown")
+    else:
+        await callback.message.edit_text("⚠ Это время уже недоступно для записи.")
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("unwait:"))
+async def leave_wait(callback: CallbackQuery):
+    slot_id = int(callback.data.split(":")[1])
+    await leave_waitlist(callback.from_user.id, slot_id)
+    await callback.message.edit_text("🚪 Вы вышли из очереди.")
+    await callback.message.answer(START_TEXT, parse_mode="Markdown")
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("hold_ok:"))
+async def confirm_waitlist_seat(callback: CallbackQuery):
+    booking_id = int(callback.data.split(":")[1])
+    user_id = callback.from_user.id
+    start_time_iso = await confirm_hold(booking_id, user_id)
+
+    if start_time_iso is None:
+        await callback.message.edit_text("⌛ Это место уже передано следующему в очереди.")
+    else:
+        cancel_hold_timer(booking_id)
+        schedule_reminder(user_id, start_time_iso)
+        slot_time = datetime.fromisoformat(start_time_iso).strftime("%d.%m в %H:%M")
+        await callback.message.edit_text(f"✅ Вы успешно записаны на **{slot_time}**!", parse_mode="Markdown")
+        logger.info(f"ЗАПИСЬ: Пользователь {user_id} на {slot_time} (из очереди)", extra={
+            "user_id": user_id, "slot": start_time_iso, "action": "waitlist_confirm"
+        })
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("hold_no:"))
+async def decline_waitlist_seat(callback: CallbackQuery):
+    booking_id = int(callback.data.split(":")[1])
+    owner, promotions = await expire_hold(booking_id, callback.from_user.id)
+    if owner is None:
+        # Место уже подтверждено (запись осталась) или уже ушло дальше по таймеру.
+        await callback.message.edit_text("Это предложение уже не действует. Ваши записи — в /my.")
+        return await callback.answer()
+    cancel_hold_timer(booking_id)
+    await callback.message.edit_text("Хорошо, место передано следующему в очереди.")
+    await callback.answer()
+    await notify_promotions(callback.bot, promotions)
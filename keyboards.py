@@ -1,5 +1,8 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import date, time, datetime
+from datetime import date
+from functools import lru_cache
+
+from config import KEYBOARD_CACHE_SIZE
 
 
 def days_keyboard(days: list[date], prefix: str) -> InlineKeyboardMarkup:
@@ -15,33 +18,54 @@ def days_keyboard(days: list[date], prefix: str) -> InlineKeyboardMarkup:
 def slots_keyboard(slots: list) -> InlineKeyboardMarkup:
     buttons = []
     for slot in slots:
-        s_id = slot[0]
-        start_dt = datetime.fromisoformat(slot[1])
+        text = slot.start_dt.strftime("%H:%M")
+        if slot.capacity > 1:
+            text += f" · мест: {slot.seats_left}"
         buttons.append([InlineKeyboardButton(
-            text=start_dt.strftime("%H:%M"),
-            callback_data=f"slot:{s_id}"
+            text=text,
+            callback_data=f"slot:{slot.id}"
         )])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def waitlist_offer_keyboard(slot_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+        text="🕓 Встать в очередь", callback_data=f"wait:{slot_id}"
+    )]])
+
+
+def waitlist_keyboard(slot_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+        text="🚪 Выйти из очереди", callback_data=f"unwait:{slot_id}"
+    )]])
+
+
+def hold_keyboard(booking_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"hold_ok:{booking_id}"),
+        InlineKeyboardButton(text="❌ Отказаться", callback_data=f"hold_no:{booking_id}"),
+    ]])
+
+
 def bookings_keyboard(bookings: list) -> InlineKeyboardMarkup:
     buttons = []
     for b in bookings:
-        b_id = b[0]
-        start_dt = datetime.fromisoformat(b[1])
         buttons.append([InlineKeyboardButton(
-            text=f"❌ {start_dt.strftime('%d.%m %H:%M')}",
-            callback_data=f"cancel:{b_id}"
+            text=f"❌ {b.start_dt.strftime('%d.%m %H:%M')}",
+            callback_data=f"cancel:{b.id}"
         )])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def slots_tickbox(all_times: list[time], selected: set[str]) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def slots_tickbox(grid: tuple[str, ...], mask: int) -> InlineKeyboardMarkup:
+    """
+    Сетка времен для админа; i-й бит mask отмечает grid[i].
+    Разметка кэшируется по (grid, mask) — не изменяйте возвращаемый объект.
+    """
     buttons = []
-    for t in all_times:
-        t_str = t.strftime("%H:%M")
-        
-        mark = "✅ " if t_str in selected else ""
+    for i, t_str in enumerate(grid):
+        mark = "✅ " if mask >> i & 1 else ""
         
         buttons.append([InlineKeyboardButton(
             text=f"{mark}{t_str}",
@@ -52,4 +76,13 @@ def slots_tickbox(all_times: list[time], selected: set[str]) -> InlineKeyboardMa
         text="✔ ПОДТВЕРДИТЬ",
         callback_data="confirm_slots"
     )])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
\ No newline at end of file
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def pager_keyboard(prev_data: str | None, next_data: str | None) -> InlineKeyboardMarkup | None:
+    row = []
+    if prev_data:
+        row.append(InlineKeyboardButton(text="⬅ Назад", callback_data=prev_data))
+    if next_data:
+        row.append(InlineKeyboardButton(text="Далее ➡", callback_data=next_data))
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
\ No newline at end of file
@@ -1,37 +1,121 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
+from datetime import datetime
+
+from config import LOG_FORMAT, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN
+
+# Поля, которые обработчики передают через extra={...} и которые попадают в JSON.
+EVENT_FIELDS = ("user_id", "slot", "action", "duration_ms")
 
 
 class OnlyInfoFilter(logging.Filter):
     def filter(self, record):
         return record.levelno == logging.INFO
 
-def setup_logger():
-    logger = logging.getLogger("BOT_LOG")
-    logger.setLevel(logging.INFO)
-    
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-    actions_handler = logging.FileHandler("actions.log", encoding='utf-8')
+class JsonLinesFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, сообщение и поля события."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _file_handler(filename: str) -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            filename, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True
+        )
+    return logging.handlers.RotatingFileHandler(
+        filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True
+    )
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def _start_listener(log_queue: queue.SimpleQueue, suffix: str = "") -> logging.handlers.QueueListener:
+    if LOG_FORMAT == "json":
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    actions_handler = _file_handler(f"actions{suffix}.log")
     actions_handler.setLevel(logging.INFO)
     actions_handler.addFilter(OnlyInfoFilter())
     actions_handler.setFormatter(formatter)
 
-    errors_handler = logging.FileHandler("errors.log", encoding='utf-8')
+    errors_handler = _file_handler(f"errors{suffix}.log")
     errors_handler.setLevel(logging.WARNING)
     errors_handler.setFormatter(formatter)
 
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 
-    if not logger.handlers:
-        logger.addHandler(actions_handler)
-        logger.addHandler(errors_handler)
-        logger.addHandler(console_handler)
+    listener = logging.handlers.QueueListener(
+        log_queue, actions_handler, errors_handler, console_handler,
+        respect_handler_level=True
+    )
+    listener.start()
+    return listener
+
+
+def _stop_listener():
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+
+
+def setup_logger():
+    """
+    Логгер пишет только в очередь, а файлы и консоль обслуживает QueueListener
+    в отдельном потоке, поэтому logger.info в обработчиках не блокирует event loop.
+    Файлы ротируются по размеру (LOG_MAX_BYTES) или по времени (LOG_ROTATE_WHEN).
+    """
+    global _listener
+    logger = logging.getLogger("BOT_LOG")
+    logger.setLevel(logging.INFO)
+
+    if logger.handlers:
+        return logger
+
+    log_queue = queue.SimpleQueue()
+    _listener = _start_listener(log_queue)
+    # При выходе дописываем то, что осталось в очереди.
+    atexit.register(_stop_listener)
+
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
     logging.getLogger("aiogram").setLevel(logging.ERROR)
     logging.getLogger("apscheduler").setLevel(logging.ERROR)
 
     return logger
 
-logger = setup_logger()
\ No newline at end of file
+
+def use_worker_log_files(worker_index: int):
+    """
+    Переключает процесс-воркер на свои файлы actions-w{i}.log и errors-w{i}.log:
+    ротация одних и тех же файлов из нескольких процессов переименовывает их
+    друг у друга, и строки теряются или попадают не в тот файл.
+    """
+    global _listener
+    _stop_listener()
+    _listener = _start_listener(_listener.queue, f"-w{worker_index}")
+
+logger = setup_logger()
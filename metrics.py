@@ -0,0 +1,217 @@
+"""
+Метрики процесса в текстовом формате Prometheus: время обработки обновлений,
+запросов к базе и фоновых задач. Собираются и отдаются по HTTP только при
+METRICS_PORT > 0; иначе декораторы возвращают функцию без обертки.
+"""
+import bisect
+import functools
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiohttp import web
+
+from config import METRICS_PORT, METRICS_HOST
+
+METRICS_ENABLED = METRICS_PORT > 0
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list["Counter | Histogram"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels: str, value: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счетчики по корзинам..., +Inf], сумма
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str):
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{plain} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+UPDATE_SECONDS = Histogram(
+    "bot_update_seconds", "Время обработки обновления", ("handler", "outcome"))
+DB_QUERY_SECONDS = Histogram(
+    "bot_db_query_seconds", "Время функции db.py, включая ожидание соединения", ("function",))
+DB_ROWS = Counter(
+    "bot_db_rows_total", "Строк возвращено функциями db.py", ("function",))
+DB_LOCK_WAIT_SECONDS = Histogram(
+    "bot_db_lock_wait_seconds", "Ожидание соединения: read — пул читателей, write — писатель", ("mode",))
+DB_LOCK_CONTENDED = Counter(
+    "bot_db_lock_contended_total", "Сколько раз соединение было занято к моменту запроса", ("mode",))
+JOB_SECONDS = Histogram(
+    "bot_job_seconds", "Время фоновой задачи", ("job", "outcome"),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def observe_lock_wait(mode: str, started: float, contended: bool):
+    if not METRICS_ENABLED:
+        return
+    DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, mode)
+    if contended:
+        DB_LOCK_CONTENDED.inc(mode)
+
+
+def timed_query(func):
+    """Декоратор функций db.py: время вызова и число строк, если вернулся список."""
+    if not METRICS_ENABLED:
+        return func
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - t0, name)
+        if isinstance(result, list):
+            DB_ROWS.inc(name, value=len(result))
+        return result
+
+    return wrapper
+
+
+def timed_job(func):
+    """Декоратор фоновых задач планировщика."""
+    if not METRICS_ENABLED:
+        return func
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await func(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            JOB_SECONDS.observe(time.perf_counter() - t0, name, outcome)
+
+    return wrapper
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на update: меряет обработку целиком. Имя обработчика
+    записывает HandlerNameMiddleware, который срабатывает уже после фильтров.
+    """
+
+    async def __call__(self, handler, event, data):
+        slot = data["metrics_handler"] = ["none"]
+        t0 = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await handler(event, data)
+            outcome = "unhandled" if result is UNHANDLED else "ok"
+            return result
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - t0, slot[0], outcome)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+
+    async def __call__(self, handler, event, data):
+        slot = data.get("metrics_handler")
+        handler_object = data.get("handler")
+        if slot is not None and handler_object is not None:
+            callback = handler_object.callback
+            slot[0] = f"{callback.__module__}.{getattr(callback, '__name__', type(callback).__name__)}"
+        return await handler(event, data)
+
+
+def setup_metrics(dp):
+    """Подключает middleware к диспетчеру; без METRICS_PORT ничего не делает."""
+    if not METRICS_ENABLED:
+        return
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    name_middleware = HandlerNameMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(name_middleware)
+
+
+async def start_metrics_server(port_offset: int = 0) -> web.AppRunner | None:
+    """
+    Поднимает /metrics на METRICS_HOST:METRICS_PORT + port_offset
+    (у каждого webhook-воркера свой порт). Возвращает runner для cleanup().
+    """
+    if not METRICS_ENABLED:
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT + port_offset).start()
+    return runner
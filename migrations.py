@@ -0,0 +1,410 @@
+"""
+Версионные миграции схемы SQLite на PRAGMA user_version.
+
+    python migrations.py             применить недостающие миграции
+    python migrations.py --status    текущая версия и список ожидающих
+    python migrations.py --dry-run   прогнать миграции на копии базы в памяти
+
+Бот при старте вызывает их сам (db.init_db), так что запуск вручную нужен,
+чтобы заранее проверить или выполнить долгие миграции до старта воркеров.
+"""
+import argparse
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from typing import NamedTuple
+
+import aiosqlite
+
+from config import DB_NAME, DB_ENGINE, DB_BUSY_TIMEOUT_MS, DB_MIGRATION_BATCH_SIZE
+from logger_config import logger
+
+
+class Migration(NamedTuple):
+    """
+    Шаг схемы. apply выполняется одной транзакцией вместе с повышением
+    user_version. batch — для больших таблиц: вызывается отдельными
+    транзакциями по size строк и возвращает число обработанных; версия
+    повышается в той транзакции, где батч обработал меньше size.
+    """
+    version: int
+    description: str
+    apply: Callable[[aiosqlite.Connection], Awaitable[None]] | None = None
+    batch: Callable[[aiosqlite.Connection, int], Awaitable[int]] | None = None
+
+
+async def _columns(db: aiosqlite.Connection, table: str) -> set[str]:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in await cursor.fetchall()}
+
+
+async def _bookings_unique_by_slot(db: aiosqlite.Connection) -> bool:
+    cursor = await db.execute("PRAGMA index_list(bookings)")
+    for _, index_name, unique, *_ in await cursor.fetchall():
+        if not unique:
+            continue
+        info = await db.execute(f"PRAGMA index_info({index_name!r})")
+        if [row[2] for row in await info.fetchall()] == ["slot_id"]:
+            return True
+    return False
+
+
+async def _initial_schema(db: aiosqlite.Connection):
+    """
+    Схема на момент появления миграций. Базы без user_version могли остаться
+    от любой прежней версии бота, поэтому шаг идемпотентен и сам доводит
+    старые таблицы: slots.day, места в слотах, bookings.confirm_by.
+    """
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS slots (
+        id INTEGER PRIMARY KEY,
+        start_time TEXT UNIQUE,
+        end_time TEXT,
+        is_booked INTEGER DEFAULT 0,
+        day TEXT,
+        capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity >= 1),
+        booked_count INTEGER NOT NULL DEFAULT 0
+    )""")
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS bookings (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        user_name TEXT,
+        slot_id INTEGER,
+        confirm_by TEXT,
+        UNIQUE (slot_id, user_id)
+    )""")
+
+    # Очередь на занятые слоты; порядок — по id.
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS waitlist (
+        id INTEGER PRIMARY KEY,
+        slot_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        UNIQUE (slot_id, user_id)
+    )""")
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        full_name TEXT
+    )""")
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS settings_limits (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL CHECK (value >= 1)
+    )
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS archive_slots (
+        start_time TEXT PRIMARY KEY,
+        day TEXT NOT NULL,
+        booked INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS archive_bookings (
+        id INTEGER PRIMARY KEY,
+        day TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        user_id INTEGER,
+        user_name TEXT
+    )""")
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS schedule_template (
+        weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+        start TEXT NOT NULL,
+        duration_minutes INTEGER NOT NULL DEFAULT 60 CHECK (duration_minutes > 0),
+        capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity >= 1),
+        PRIMARY KEY (weekday, start)
+    ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS schedule_exceptions (
+        day TEXT PRIMARY KEY
+    ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS schedule_materialized (
+        day TEXT PRIMARY KEY
+    ) WITHOUT ROWID
+    """)
+
+    columns = await _columns(db, "slots")
+    if "day" not in columns:
+        await db.execute("ALTER TABLE slots ADD COLUMN day TEXT")
+    if "capacity" not in columns:
+        await db.execute("ALTER TABLE slots ADD COLUMN capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity >= 1)")
+    if "booked_count" not in columns:
+        await db.execute("ALTER TABLE slots ADD COLUMN booked_count INTEGER NOT NULL DEFAULT 0")
+        await db.execute("""
+            UPDATE slots SET booked_count = (SELECT COUNT(*) FROM bookings b WHERE b.slot_id = slots.id)
+        """)
+
+    if "capacity" not in await _columns(db, "schedule_template"):
+        await db.execute(
+            "ALTER TABLE schedule_template ADD COLUMN capacity INTEGER NOT NULL DEFAULT 1 CHECK (capacity >= 1)"
+        )
+
+    # Старые bookings с UNIQUE(slot_id) пересоздаем с UNIQUE(slot_id, user_id).
+    if await _bookings_unique_by_slot(db):
+        await db.execute("""
+            CREATE TABLE bookings_multi_seat (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                user_name TEXT,
+                slot_id INTEGER,
+                UNIQUE (slot_id, user_id)
+            )""")
+        await db.execute("""
+            INSERT INTO bookings_multi_seat (id, user_id, user_name, slot_id)
+            SELECT id, user_id, user_name, slot_id FROM bookings
+        """)
+        await db.execute("DROP TABLE bookings")
+        await db.execute("ALTER TABLE bookings_multi_seat RENAME TO bookings")
+
+    if "confirm_by" not in await _columns(db, "bookings"):
+        await db.execute("ALTER TABLE bookings ADD COLUMN confirm_by TEXT")
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_day ON slots (day, start_time)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_free ON slots (is_booked, start_time)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_hold ON bookings (confirm_by) WHERE confirm_by IS NOT NULL")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_user ON waitlist (user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_states (updated_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_archive_slots_day ON archive_slots (day)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_archive_bookings_day ON archive_bookings (day, start_time)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_archive_bookings_user ON archive_bookings (user_id)")
+
+
+async def _backfill_slot_day(db: aiosqlite.Connection, size: int) -> int:
+    """Заполняет slots.day у строк, оставшихся от баз до появления колонки."""
+    cursor = await db.execute("""
+        UPDATE slots SET day = substr(start_time, 1, 10)
+        WHERE id IN (SELECT id FROM slots WHERE day IS NULL LIMIT ?)
+    """, (size,))
+    return cursor.rowcount
+
+
+async def _day_summary(db: aiosqlite.Connection):
+    """
+    Сводка по дням для отчетов админа: число слотов, занятые места и версия,
+    которую триггеры увеличивают при любом изменении слотов дня. По версии
+    notifications понимает, что готовый текст отчета за день устарел.
+    """
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS day_summary (
+        day TEXT PRIMARY KEY,
+        slots INTEGER NOT NULL DEFAULT 0,
+        booked INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 1
+    ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        INSERT OR REPLACE INTO day_summary (day, slots, booked)
+        SELECT day, COUNT(*), SUM(booked_count) FROM slots WHERE day IS NOT NULL GROUP BY day
+    """)
+
+    # Записи меняют сводку только через slots.booked_count, который ведет db.py.
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_day_summary_insert AFTER INSERT ON slots
+    WHEN NEW.day IS NOT NULL
+    BEGIN
+        INSERT INTO day_summary (day, slots, booked) VALUES (NEW.day, 1, NEW.booked_count)
+        ON CONFLICT (day) DO UPDATE SET
+            slots = slots + 1, booked = booked + excluded.booked, version = version + 1;
+    END
+    """)
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_day_summary_delete AFTER DELETE ON slots
+    BEGIN
+        UPDATE day_summary SET slots = slots - 1, booked = booked - OLD.booked_count, version = version + 1
+        WHERE day = OLD.day;
+    END
+    """)
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_day_summary_update
+    AFTER UPDATE OF day, start_time, capacity, booked_count ON slots
+    BEGIN
+        UPDATE day_summary SET slots = slots - 1, booked = booked - OLD.booked_count, version = version + 1
+        WHERE day = OLD.day;
+        INSERT INTO day_summary (day, slots, booked)
+        SELECT NEW.day, 1, NEW.booked_count WHERE NEW.day IS NOT NULL
+        ON CONFLICT (day) DO UPDATE SET
+            slots = slots + 1, booked = booked + excluded.booked, version = version + 1;
+    END
+    """)
+
+
+async def _bookings_autoincrement(db: aiosqlite.Connection):
+    """
+    Пересоздает bookings с AUTOINCREMENT: id удаленной записи больше не выдается
+    новой, и старая кнопка «отменить» или таймер места из очереди
+    не попадут в чужую запись.
+    """
+    await db.execute("""
+        CREATE TABLE bookings_autoincrement (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            slot_id INTEGER,
+            confirm_by TEXT,
+            UNIQUE (slot_id, user_id)
+        )""")
+    await db.execute("""
+        INSERT INTO bookings_autoincrement (id, user_id, user_name, slot_id, confirm_by)
+        SELECT id, user_id, user_name, slot_id, confirm_by FROM bookings
+    """)
+    await db.execute("DROP TABLE bookings")
+    await db.execute("ALTER TABLE bookings_autoincrement RENAME TO bookings")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_hold ON bookings (confirm_by) WHERE confirm_by IS NOT NULL")
+
+
+# Только дописывать в конец: примененные шаги не меняются.
+MIGRATIONS: list[Migration] = [
+    Migration(1, "начальная схема и доводка старых баз", apply=_initial_schema),
+    Migration(2, "заполнение slots.day пачками", batch=_backfill_slot_day),
+    Migration(3, "сводка по дням для отчетов", apply=_day_summary),
+    Migration(4, "bookings.id без повторного использования", apply=_bookings_autoincrement),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def get_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    return (await cursor.fetchone())[0]
+
+
+def pending(version: int) -> list[Migration]:
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+async def _set_version(db: aiosqlite.Connection, version: int):
+    # PRAGMA не принимает параметры; version — всегда int из MIGRATIONS.
+    await db.execute(f"PRAGMA user_version = {int(version)}")
+
+
+async def _run_step(db: aiosqlite.Connection, migration: Migration, size: int) -> bool:
+    """
+    Одна транзакция шага. Версию перечитываем под BEGIN IMMEDIATE: соседний
+    воркер мог уже применить шаг. Возвращает True, когда шаг завершен.
+    """
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        if await get_version(db) >= migration.version:
+            await db.rollback()
+            return True
+        done = True
+        if migration.apply is not None:
+            await migration.apply(db)
+        if migration.batch is not None:
+            done = await migration.batch(db, size) < size
+        if done:
+            await _set_version(db, migration.version)
+    except BaseException:
+        await db.rollback()
+        raise
+    await db.commit()
+    return done
+
+
+async def migrate(db: aiosqlite.Connection, batch_size: int = DB_MIGRATION_BATCH_SIZE) -> int:
+    """
+    Применяет недостающие миграции на соединении без открытой транзакции.
+    Если схема актуальна, выходит после одного PRAGMA без DDL.
+    Между пачками отдает управление event loop'у. Возвращает итоговую версию.
+    """
+    version = await get_version(db)
+    if version > SCHEMA_VERSION:
+        logger.warning(f"Версия схемы базы {version} новее известной коду ({SCHEMA_VERSION})")
+        return version
+
+    batch_size = max(batch_size, 1)
+    for migration in pending(version):
+        started = time.perf_counter()
+        batches = 0
+        while True:
+            batches += 1
+            if await _run_step(db, migration, batch_size):
+                break
+            await asyncio.sleep(0)
+        logger.info(
+            f"Миграция {migration.version} ({migration.description}) применена "
+            f"за {time.perf_counter() - started:.2f} с" + (f", пачек: {batches}" if migration.batch else "")
+        )
+    return await get_version(db)
+
+
+async def _connect(path: str) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    await conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    return conn
+
+
+async def _status(path: str):
+    conn = await _connect(path)
+    try:
+        version = await get_version(conn)
+    finally:
+        await conn.close()
+    print(f"{path}: версия схемы {version}, последняя {SCHEMA_VERSION}")
+    for m in pending(version):
+        print(f"  ожидает {m.version}: {m.description}")
+
+
+async def _run(path: str, dry_run: bool, batch_size: int):
+    await _status(path)
+    conn = await _connect(path)
+    try:
+        if dry_run:
+            # Копия в памяти: на ней миграции проходят целиком, файл не меняется.
+            target = await _connect(":memory:")
+            try:
+                await conn.backup(target)
+                version = await migrate(target, batch_size)
+            finally:
+                await target.close()
+            print(f"Пробный прогон: версия после миграций {version}, файл не изменен")
+        else:
+            version = await migrate(conn, batch_size)
+            print(f"Версия схемы {version}")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_NAME, help="файл базы")
+    parser.add_argument("--status", action="store_true", help="только показать версию")
+    parser.add_argument("--dry-run", action="store_true", help="прогнать на копии в памяти")
+    parser.add_argument("--batch-size", type=int, default=DB_MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+    if DB_ENGINE == "memory":
+        print("DB_ENGINE=memory: база создается при старте бота, мигрировать нечего")
+        return
+    if args.status:
+        asyncio.run(_status(args.db))
+    else:
+        asyncio.run(_run(args.db, args.dry_run, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 import asyncio
+from collections.abc import Callable
 from logger_config import logger
 from datetime import datetime, timedelta, date
 from aiogram import Bot
 
-from config import ADMIN_IDS
-from db import get_bookings_for_day, clear_day_data, get_bookings_in_time_range
+from config import ADMIN_IDS, ARCHIVE_RETENTION_DAYS, SCHEDULE_WEEKS_AHEAD
+from broadcast import broadcast, OutgoingMessage
+from cache import LRUCache
+from metrics import timed_job
+from db import (get_bookings_for_day, get_day_summary, archive_finished_slots, purge_archive,
+                has_booking, materialize_schedule, ScheduleDiff, DaySummary)
+
+# (вид отчета, день) -> (версия сводки дня, готовый текст).
+_report_cache = LRUCache(32)
 
 
 def escape_md(text: str) -> str:
@@ -12,73 +20,141 @@ def escape_md(text: str) -> str:
     return ''.join(f'\\{char}' if char in escape_chars else char for char in text)
 
 
-async def send_daily_report_and_clear(bot: Bot):
-    today = date.today()
-    bookings = await get_bookings_for_day(today)
-    
+def booking_lines(bookings, icon: str) -> list[str]:
+    """
+    Строки отчета по записям (start_time, user_name, capacity), упорядоченным по времени:
+    одиночный слот — «время — имя», групповой — «время (занято/мест) — имена».
+    """
+    lines = []
+    group: list[str] = []
+    for i, (start_time_iso, user_info, capacity) in enumerate(bookings):
+        group.append(escape_md(user_info or ""))
+        if i + 1 < len(bookings) and bookings[i + 1][0] == start_time_iso:
+            continue
+        time_str = datetime.fromisoformat(start_time_iso).strftime("%H:%M")
+        seats = f" ({len(group)}/{capacity})" if capacity > 1 else ""
+        lines.append(f"{icon} {time_str}{seats} — {', '.join(group)}")
+        group = []
+    return lines
+
+
+def _daily_report_text(day: date, summary: DaySummary, bookings) -> str:
     if not bookings:
-        report = f"📅 Итоговый отчет за {today.strftime('%d.%m')}:\nЗаписей не было."
-    else:
-        report = f"📅 **Итоговый отчет за {today.strftime('%d.%m')}**:\n\n"
-        for start_time_iso, user_info in bookings:
-            time_str = datetime.fromisoformat(start_time_iso).strftime("%H:%M")
-            user_info = escape_md(user_info)
-            report += f"✅ {time_str} — {user_info}\n"
-    
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, report, parse_mode="Markdown")
-        except Exception as e:
-            logger.error(f"Не удалось отправить отчет за сегодня {admin_id}")
-            
-    await clear_day_data(today)
+        return f"📅 Итоговый отчет за {day.strftime('%d.%m')}:\nЗаписей не было."
+    report = f"📅 **Итоговый отчет за {day.strftime('%d.%m')}**:\n\n"
+    return report + "".join(line + "\n" for line in booking_lines(bookings, "✅"))
 
 
-async def send_tomorrow_admin_report(bot: Bot):
-    tomorrow = date.today() + timedelta(days=1)
-    bookings = await get_bookings_for_day(tomorrow)
-    
-    header = f"🔮 **План на завтра ({tomorrow.strftime('%d.%m')})**:\n\n"
-    
+def _plan_report_text(day: date, summary: DaySummary, bookings) -> str:
+    header = f"🔮 **План на завтра ({day.strftime('%d.%m')})**:\n\n"
     if not bookings:
-        text = header + "Записей пока нет."
+        return header + "Записей пока нет."
+    return header + "\n".join(booking_lines(bookings, "📌"))
+
+
+def day_overview_text(day: date, summary: DaySummary, bookings) -> str:
+    """Отчет /day: сводка по местам и записи дня."""
+    text = f"📊 **{day.strftime('%d.%m (%a)')}**: слотов {summary.slots}, занято мест {summary.booked}\n"
+    if bookings:
+        text += "\n" + "\n".join(booking_lines(bookings, "📌"))
+    return text
+
+
+async def day_report(day: date, render: Callable[[date, DaySummary, list], str]) -> str:
+    """
+    Текст отчета за день из кэша. Версия из day_summary читается по ключу;
+    записи дня перечитываются и форматируются заново, только если она сменилась.
+    Версию берем до чтения записей: при гонке кэш лишь устареет на шаг раньше.
+    """
+    summary = await get_day_summary(day)
+    key = (render.__name__, day)
+    cached = _report_cache.get(key)
+    if cached is not None and cached[0] == summary.version:
+        return cached[1]
+    bookings = await get_bookings_for_day(day) if summary.booked else []
+    text = render(day, summary, bookings)
+    _report_cache.set(key, (summary.version, text))
+    return text
+
+
+@timed_job
+async def send_daily_report_and_clear(bot: Bot):
+    report = await day_report(date.today(), _daily_report_text)
+
+    result = await broadcast(bot, (OutgoingMessage(admin_id, report) for admin_id in ADMIN_IDS))
+    for admin_id in result.failed:
+        logger.error(f"Не удалось отправить отчет за сегодня {admin_id}")
+
+    await archive_history()
+
+
+@timed_job
+async def archive_history(before: datetime | None = None):
+    """
+    Переносит слоты, завершившиеся до before (по умолчанию — до текущего момента),
+    в архив и чистит архив старше ARCHIVE_RETENTION_DAYS.
+    """
+    moved = await archive_finished_slots(before)
+    purged = await purge_archive(ARCHIVE_RETENTION_DAYS) if ARCHIVE_RETENTION_DAYS > 0 else 0
+    if moved or purged:
+        logger.info(f"АРХИВ: перенесено слотов {moved}, удалено старых записей {purged}")
+
+
+@timed_job
+async def send_tomorrow_admin_report(bot: Bot):
+    text = await day_report(date.today() + timedelta(days=1), _plan_report_text)
+
+    result = await broadcast(bot, (OutgoingMessage(admin_id, text) for admin_id in ADMIN_IDS))
+    for admin_id in result.failed:
+        logger.error(f"Не удалось отправить план на завтра {admin_id}")
+
+
+def schedule_diff_text(diff: ScheduleDiff) -> str:
+    added = sum(len(times) for times in diff.added.values())
+    if not added:
+        text = "🗓 Расписание уже опубликовано, новых слотов нет."
     else:
-        lines = []
-        for start_time_iso, user_info in bookings:
-            time_str = datetime.fromisoformat(start_time_iso).strftime("%H:%M")
-            user_info = escape_md(user_info)
-            lines.append(f"📌 {time_str} — {user_info}")
-        text = header + "\n".join(lines)
-        
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, text, parse_mode="Markdown")
-        except Exception:
-            logger.error(f"Не удалось отправить план на завтра {admin_id}")
-
-
-async def send_2h_reminders(bot: Bot):
-    now = datetime.now()
-    target_time = now + timedelta(hours=2)
-    
-    start_range = target_time.replace(minute=28, second=0, microsecond=0)
-    end_range = target_time.replace(minute=33, second=0, microsecond=0)
-    
-    bookings = await get_bookings_in_time_range(start_range, end_range)
-    
-    if not bookings:
+        text = f"🗓 **Опубликовано слотов: {added}** на дней: {len(diff.added)}\n"
+        text += "\n".join(
+            f"  • {day.strftime('%d.%m (%a)')}: {len(times)}" for day, times in sorted(diff.added.items())
+        )
+    if diff.skipped:
+        text += "\n⏭ Пропущены: " + ", ".join(day.strftime("%d.%m") for day in diff.skipped)
+    return text
+
+
+@timed_job
+async def publish_schedule(bot: Bot):
+    """Продлевает расписание по шаблону на SCHEDULE_WEEKS_AHEAD недель и сообщает админам о новых слотах."""
+    diff = await materialize_schedule(SCHEDULE_WEEKS_AHEAD)
+    if not diff.added:
         return
+    added = sum(len(times) for times in diff.added.values())
+    logger.info(f"РАСПИСАНИЕ: по шаблону добавлено слотов {added}")
+    text = schedule_diff_text(diff)
+    result = await broadcast(bot, (OutgoingMessage(admin_id, text) for admin_id in ADMIN_IDS))
+    for admin_id in result.failed:
+        logger.error(f"Не удалось отправить отчет о расписании {admin_id}")
 
-    for user_id, start_time_iso, _ in bookings:
-        dt = datetime.fromisoformat(start_time_iso)
-        time_str = dt.strftime("%H:%M")
-        
-        text = (
-            f"👋 Привет!\n"
-            f"⏳ Напоминаем: ваше занятие сегодня в **{time_str}**.\n"
-            f"Ждем вас через 2 часа!"
-        )
-        try:
-            await bot.send_message(user_id, text, parse_mode="Markdown")
-        except Exception:
-            logger.error(f"Не удалось отправить напоминание {user_id}")
\ No newline at end of file
+
+@timed_job
+async def send_reminder(bot: Bot, user_id: int, start_time_iso: str):
+    # Запись могли отменить в другом процессе, где нет планировщика.
+    if not await has_booking(user_id, start_time_iso):
+        return
+
+    dt = datetime.fromisoformat(start_time_iso)
+    day_word = "сегодня" if dt.date() == date.today() else dt.strftime("%d.%m")
+    minutes_left = max(int((dt - datetime.now()).total_seconds() // 60), 0)
+    hours, minutes = divmod(minutes_left, 60)
+    left_str = " ".join(p for p in (f"{hours} ч" if hours else "",
+                                    f"{minutes} мин" if minutes or not hours else "") if p)
+
+    text = (
+        f"👋 Привет!\n"
+        f"⏳ Напоминаем: ваше занятие {day_word} в **{dt.strftime('%H:%M')}**.\n"
+        f"Ждем вас через {left_str}!"
+    )
+    result = await broadcast(bot, [OutgoingMessage(user_id, text)])
+    for user_id in result.failed:
+        logger.error(f"Не удалось отправить напоминание {user_id}")
\ No newline at end of file
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from aiogram import Bot
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.base import JobLookupError
+
+from config import REMINDER_LEAD_MINUTES
+from db import get_upcoming_bookings
+from notifications import send_reminder
+
+REMINDER_LEAD = timedelta(minutes=REMINDER_LEAD_MINUTES)
+
+_scheduler: AsyncIOScheduler | None = None
+_bot: Bot | None = None
+# Ключи напоминаний, уже поставленных этим процессом (в том числе отработавших).
+_scheduled: set[str] = set()
+
+
+def setup_reminders(scheduler: AsyncIOScheduler, bot: Bot):
+    global _scheduler, _bot
+    _scheduler = scheduler
+    _bot = bot
+
+
+def _job_id(user_id: int, start_time_iso: str) -> str:
+    return f"reminder:{user_id}:{start_time_iso}"
+
+
+def schedule_reminder(user_id: int, start_time_iso: str):
+    """
+    Ставит разовое напоминание за REMINDER_LEAD до начала занятия.
+    Если до начала уже меньше, напоминание уходит сразу.
+    """
+    if _scheduler is None:
+        return
+    start_dt = datetime.fromisoformat(start_time_iso)
+    now = datetime.now()
+    if start_dt <= now:
+        return
+    run_at = max(start_dt - REMINDER_LEAD, now)
+    job_id = _job_id(user_id, start_time_iso)
+    _scheduler.add_job(
+        send_reminder, "date",
+        run_date=run_at.astimezone(),
+        args=[_bot, user_id, start_time_iso],
+        id=job_id,
+        replace_existing=True,
+        misfire_grace_time=int(REMINDER_LEAD.total_seconds()),
+    )
+    _scheduled.add(job_id)
+
+
+def cancel_reminder(user_id: int, start_time_iso: str):
+    if _scheduler is None:
+        return
+    _scheduled.discard(_job_id(user_id, start_time_iso))
+    try:
+        _scheduler.remove_job(_job_id(user_id, start_time_iso))
+    except JobLookupError:
+        pass
+
+
+def cancel_all_reminders():
+    if _scheduler is None:
+        return
+    _scheduled.clear()
+    for job in _scheduler.get_jobs():
+        if job.id.startswith("reminder:"):
+            job.remove()
+
+
+async def restore_reminders() -> int:
+    """
+    Ставит напоминания для всех будущих записей. Вызывается при старте, а при
+    нескольких воркерах — периодически, чтобы подхватить записи из других процессов.
+    """
+    bookings = await get_upcoming_bookings()
+    current = {_job_id(user_id, start_time_iso) for user_id, start_time_iso in bookings}
+    _scheduled.intersection_update(current)
+    added = 0
+    for user_id, start_time_iso in bookings:
+        if _job_id(user_id, start_time_iso) not in _scheduled:
+            schedule_reminder(user_id, start_time_iso)
+            added += 1
+    return added
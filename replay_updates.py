@@ -0,0 +1,48 @@
+"""
+Отправляет записанные обновления Telegram на локальный webhook-сервер бота.
+
+    python replay_updates.py updates.jsonl
+    python replay_updates.py update.json --url http://127.0.0.1:8080/webhook
+
+Файл — один JSON-объект Update, JSON-массив или по объекту на строку.
+"""
+import argparse
+import asyncio
+import json
+
+from aiohttp import ClientSession
+
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    try:
+        return [json.loads(text)]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def replay(url: str, updates: list[dict], secret: str | None):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with ClientSession() as session:
+        for update in updates:
+            async with session.post(url, json=update, headers=headers) as resp:
+                body = await resp.text()
+                print(f"update {update.get('update_id')}: {resp.status} {body[:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="файл с обновлениями")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    args = parser.parse_args()
+    asyncio.run(replay(args.url, load_updates(args.path), args.secret))
+
+
+if __name__ == "__main__":
+    main()
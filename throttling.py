@@ -0,0 +1,85 @@
+import contextlib
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, Message
+
+from cache import LRUCache
+from config import THROTTLE_RATE, THROTTLE_BURST, THROTTLE_CACHE_SIZE
+
+THROTTLED_TEXT = "⏳ Слишком часто, подождите пару секунд."
+
+
+def event_kind(event: Message | CallbackQuery) -> str:
+    """Вид события для отдельного ведра: префикс callback data, команда или просто текст."""
+    if isinstance(event, CallbackQuery):
+        return "cb:" + (event.data or "").split(":", 1)[0]
+    text = event.text or ""
+    if text.startswith("/"):
+        return text.split(maxsplit=1)[0].split("@", 1)[0]
+    return "text"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware роутера: token bucket на пару (пользователь, вид события).
+    Лишние события отсекаются до фильтров, обработчика и базы: на callback
+    отвечаем коротким answer(), сообщения молча пропускаем.
+    Повторное нажатие той же кнопки, пока первое еще обрабатывается,
+    не запускает обработчик второй раз.
+    Ведра лежат в LRU-кэше, поэтому память ограничена THROTTLE_CACHE_SIZE.
+    """
+
+    def __init__(self, rate: float = THROTTLE_RATE, burst: int = THROTTLE_BURST,
+                 maxsize: int = THROTTLE_CACHE_SIZE):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._buckets = LRUCache(maxsize)
+        self._in_flight: set[tuple[int, str]] = set()
+        self.throttled = 0
+        self.collapsed = 0
+
+    def _allow(self, key: tuple[int, str]) -> bool:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        self._buckets.set(key, (tokens - 1 if allowed else tokens, now))
+        return allowed
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "tracked": len(self._buckets),
+            "in_flight": len(self._in_flight),
+            "throttled": self.throttled,
+            "collapsed": self.collapsed,
+        }
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or self.rate <= 0:
+            return await handler(event, data)
+
+        is_callback = isinstance(event, CallbackQuery)
+        flight_key = (user.id, event.data or "") if is_callback else None
+        if flight_key is not None and flight_key in self._in_flight:
+            self.collapsed += 1
+            with contextlib.suppress(TelegramBadRequest):
+                await event.answer()
+            return None
+
+        if not self._allow((user.id, event_kind(event))):
+            self.throttled += 1
+            if is_callback:
+                with contextlib.suppress(TelegramBadRequest):
+                    await event.answer(THROTTLED_TEXT)
+            return None
+
+        if flight_key is None:
+            return await handler(event, data)
+        self._in_flight.add(flight_key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(flight_key)
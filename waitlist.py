@@ -0,0 +1,96 @@
+from datetime import datetime
+from aiogram import Bot
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.base import JobLookupError
+
+from broadcast import broadcast, OutgoingMessage
+from config import WAITLIST_CONFIRM_MINUTES
+from db import Promotion, expire_hold, get_pending_holds
+from keyboards import hold_keyboard
+from logger_config import logger
+
+_scheduler: AsyncIOScheduler | None = None
+_bot: Bot | None = None
+
+
+def setup_waitlist(scheduler: AsyncIOScheduler, bot: Bot):
+    global _scheduler, _bot
+    _scheduler = scheduler
+    _bot = bot
+
+
+def _job_id(booking_id: int) -> str:
+    return f"hold:{booking_id}"
+
+
+def _schedule_expiry(booking_id: int, confirm_by: str):
+    if _scheduler is None:
+        return
+    _scheduler.add_job(
+        _expire, "date",
+        run_date=max(datetime.fromisoformat(confirm_by), datetime.now()).astimezone(),
+        args=[booking_id],
+        id=_job_id(booking_id),
+        replace_existing=True,
+        misfire_grace_time=None,
+    )
+
+
+def cancel_hold_timer(booking_id: int):
+    if _scheduler is None:
+        return
+    try:
+        _scheduler.remove_job(_job_id(booking_id))
+    except JobLookupError:
+        pass
+
+
+async def notify_promotions(bot: Bot, promotions: list[Promotion]):
+    """
+    Сообщает очередникам об освободившемся месте и ставит таймер на подтверждение.
+    Без планировщика в процессе таймер поставит restore_holds в воркере 0.
+    """
+    if not promotions:
+        return
+    messages = []
+    for p in promotions:
+        _schedule_expiry(p.booking_id, p.confirm_by)
+        slot_time = datetime.fromisoformat(p.start_time).strftime("%d.%m в %H:%M")
+        logger.info(f"ОЧЕРЕДЬ: Пользователю {p.user_id} отдано место на {slot_time}", extra={
+            "user_id": p.user_id, "slot": p.start_time, "action": "waitlist_promote"
+        })
+        messages.append(OutgoingMessage(
+            p.user_id,
+            f"🎉 Освободилось место на **{slot_time}**, оно закреплено за вами!\n"
+            f"Подтвердите запись в течение {WAITLIST_CONFIRM_MINUTES} мин, "
+            "иначе место перейдет следующему в очереди.",
+            reply_markup=hold_keyboard(p.booking_id),
+        ))
+    await broadcast(bot, messages)
+
+
+async def _expire(booking_id: int):
+    user_id, promotions = await expire_hold(booking_id)
+    if user_id is not None:
+        logger.info(f"ОЧЕРЕДЬ: Пользователь {user_id} не подтвердил место", extra={
+            "user_id": user_id, "action": "waitlist_expire"
+        })
+        await broadcast(_bot, [OutgoingMessage(
+            user_id, "⌛ Время на подтверждение вышло, место передано следующему в очереди."
+        )])
+    await notify_promotions(_bot, promotions)
+
+
+async def restore_holds() -> int:
+    """
+    Ставит таймеры для всех мест из очереди, ждущих подтверждения.
+    Вызывается при старте и, при нескольких воркерах, периодически.
+    """
+    if _scheduler is None:
+        return 0
+    added = 0
+    for booking_id, confirm_by in await get_pending_holds():
+        if _scheduler.get_job(_job_id(booking_id)) is None:
+            _schedule_expiry(booking_id, confirm_by)
+            added += 1
+    return added